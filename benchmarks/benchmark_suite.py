@@ -0,0 +1,185 @@
+"""
+Measures every (v, n, delta) configuration and the BYOM tf-idf model on the training file and on synthetic
+corpora upscaled from it: import time, training throughput, post_parse()/compute() time, scoring
+throughput and peak RSS. Each configuration runs in its own process so that its peak RSS is its own.
+Results are written to a JSON file, see compare_benchmarks.py to compare two of them.
+
+usage: python benchmarks/benchmark_suite.py [--scales 1,10,100,1000] [--output results.json]
+                                            [training_file] [testing_file]
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import redirect_stdout
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+DEFAULT_TRAINING_FILE = 'input/training-tweets.txt'
+DEFAULT_TESTING_FILE = 'input/test-tweets-given.txt'
+DEFAULT_SCALES = '1,10'  # 100 and 1000 take minutes and gigabytes
+BYOM = (-1, -1, -1.0)
+CONFIGS = [(vocabulary, n, 0.5) for vocabulary in (0, 1, 2) for n in (1, 2, 3)] + [BYOM]
+TEST_BATCH_SIZE = 1024
+SEED = 472
+
+
+def upscaled_corpus(training_file: str, scale: int, data_dir: str) -> str:
+    """
+    Writes the training file scale times, shuffling the words of every tweet after the first copy so that
+    the corpus keeps its languages and vocabulary without only repeating the same n-grams. Built once
+    """
+    if scale == 1:
+        return training_file
+    path = os.path.join(data_dir, '{}.x{}'.format(os.path.basename(training_file), scale))
+    if os.path.exists(path):
+        return path
+
+    from records import iter_records, open_lines
+    with open_lines(training_file) as lines:
+        records = list(iter_records(lines, lambda line: None))
+    shuffler = random.Random(SEED)
+    os.makedirs(data_dir, exist_ok=True)
+    with open(path + '.tmp', 'w') as f:
+        for copy in range(scale):
+            for record in records:
+                content = record.content.rstrip('\n')
+                if copy > 0:
+                    words = content.split(' ')
+                    shuffler.shuffle(words)
+                    content = ' '.join(words)
+                f.write('{}-{}\t{}\t{}\t{}\n'.format(record.tweet_id, copy, record.username, record.language,
+                                                     content))
+    os.replace(path + '.tmp', path)
+    return path
+
+
+def import_seconds() -> float:
+    """
+    Time to import the modules of nlp.py in a fresh interpreter
+    """
+    output = subprocess.check_output([sys.executable, '-c', 'import time; start = time.perf_counter(); '
+                                                           'import nlp; print(time.perf_counter() - start)'],
+                                     cwd=ROOT, stderr=subprocess.DEVNULL)
+    return float(output.decode().split()[-1])
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is in kilobytes on Linux, in bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1 << 20) if sys.platform == 'darwin' else peak / 1024
+
+
+def run_one(vocabulary: int, n: int, delta: float, training_file: str, testing_file: str, tokenizer: str) -> dict:
+    """
+    Trains then scores one configuration in this process
+    """
+    from parser import NgramTrainingDataParser, TFIDFWithStopWordTrainingParser
+    from records import iter_records, open_lines
+
+    if (vocabulary, n, delta) == BYOM:
+        training_parser = TFIDFWithStopWordTrainingParser(training_file, tokenizer)
+    else:
+        training_parser = NgramTrainingDataParser(training_file, n, vocabulary, delta)
+    with open_lines(testing_file) as lines:
+        tweets = [record.content for record in iter_records(lines, lambda line: None)]
+
+    with redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        with open_lines(training_file) as lines:
+            document_count = training_parser._parse_records(lines, 'training')
+        trained = time.perf_counter()
+        training_parser.document_count = document_count
+        training_parser._post_parse(document_count)
+        computed = time.perf_counter()
+
+    for batch_start in range(0, len(tweets), TEST_BATCH_SIZE):
+        training_parser.score_batch(tweets[batch_start:batch_start + TEST_BATCH_SIZE])
+    scored = time.perf_counter()
+
+    return {
+        'training_rows': document_count,
+        'training_seconds': trained - start,
+        'training_rows_per_s': document_count / (trained - start),
+        'post_parse_seconds': computed - trained,
+        'scored_tweets': len(tweets),
+        'scoring_seconds': scored - computed,
+        'scoring_tweets_per_s': len(tweets) / (scored - computed),
+        'peak_rss_mb': peak_rss_mb()
+    }
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=ROOT, stderr=subprocess.DEVNULL) \
+            .decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ''
+
+
+def main():
+    argument_parser = argparse.ArgumentParser(description='Benchmark suite of the language models')
+    argument_parser.add_argument('training_file', nargs='?', default=DEFAULT_TRAINING_FILE)
+    argument_parser.add_argument('testing_file', nargs='?', default=DEFAULT_TESTING_FILE)
+    argument_parser.add_argument('--scales', default=DEFAULT_SCALES,
+                                 help='Comma separated sizes of the training corpora, as multiples of training_file')
+    argument_parser.add_argument('--configs', default='',
+                                 help='Comma separated v:n:delta configurations to run, all of them by default')
+    argument_parser.add_argument('--tokenizer', default='fast', help='Tokenizer of the BYOM model')
+    argument_parser.add_argument('--data-dir', default=os.path.join(tempfile.gettempdir(), 'nlp-benchmarks'),
+                                 help='Directory of the upscaled corpora')
+    argument_parser.add_argument('--output', default='benchmark-results.json')
+    argument_parser.add_argument('--run-one', nargs=3, metavar=('V', 'N', 'DELTA'), help=argparse.SUPPRESS)
+    args = argument_parser.parse_args()
+
+    if args.run_one:
+        vocabulary, n, delta = int(args.run_one[0]), int(args.run_one[1]), float(args.run_one[2])
+        print(json.dumps(run_one(vocabulary, n, delta, args.training_file, args.testing_file, args.tokenizer)))
+        return
+
+    configs = CONFIGS
+    if args.configs:
+        configs = [(int(v), int(n), float(delta)) for v, n, delta in
+                   (config.split(':') for config in args.configs.split(','))]
+    report = {
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'started': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'import_seconds': import_seconds(),
+        'results': []
+    }
+    print('import: {:.3f}s'.format(report['import_seconds']))
+
+    for scale in [int(scale) for scale in args.scales.split(',')]:
+        training_file = upscaled_corpus(args.training_file, scale, args.data_dir)
+        for vocabulary, n, delta in configs:
+            start = time.perf_counter()
+            output = subprocess.check_output(
+                [sys.executable, os.path.abspath(__file__), '--run-one', str(vocabulary), str(n), str(delta),
+                 '--tokenizer', args.tokenizer, os.path.abspath(training_file), os.path.abspath(args.testing_file)],
+                cwd=ROOT, stderr=subprocess.DEVNULL)
+            result = dict({'v': vocabulary, 'n': n, 'delta': delta, 'scale': scale,
+                           'end_to_end_seconds': time.perf_counter() - start},
+                          **json.loads(output.decode().splitlines()[-1]))
+            report['results'].append(result)
+            print('v={v} n={n} delta={delta} x{scale}: training {training_rows_per_s:.0f} rows/s, '
+                  'post_parse {post_parse_seconds:.3f}s, scoring {scoring_tweets_per_s:.0f} tweets/s, '
+                  'peak RSS {peak_rss_mb:.0f} MB, end to end {end_to_end_seconds:.2f}s'.format(**result))
+
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print('results written to {}'.format(args.output))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+"""
+Compares two result files of benchmark_suite.py, configuration by configuration. Exits with status 1 when
+a metric of the new results is worse than the baseline by more than the threshold.
+
+usage: python benchmarks/compare_benchmarks.py baseline.json new.json [--threshold 0.1] [--min-seconds 0.05]
+"""
+import argparse
+import json
+import sys
+
+# metric -> whether higher is better
+METRICS = {
+    'training_rows_per_s': True,
+    'post_parse_seconds': False,
+    'scoring_tweets_per_s': True,
+    'peak_rss_mb': False,
+    'end_to_end_seconds': False
+}
+
+
+def key(result: dict):
+    return result['v'], result['n'], result['delta'], result['scale']
+
+
+def main():
+    argument_parser = argparse.ArgumentParser(description='Compares two benchmark_suite.py result files')
+    argument_parser.add_argument('baseline')
+    argument_parser.add_argument('new')
+    argument_parser.add_argument('--threshold', type=float, default=0.1,
+                                 help='Relative change counted as a regression')
+    argument_parser.add_argument('--min-seconds', type=float, default=0.05,
+                                 help='Durations below this on both sides are too noisy to count as regressions')
+    args = argument_parser.parse_args()
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.new) as f:
+        new = json.load(f)
+
+    regressions = 0
+    print('import: {:.3f}s -> {:.3f}s'.format(baseline['import_seconds'], new['import_seconds']))
+    baseline_results = {key(result): result for result in baseline['results']}
+    for result in new['results']:
+        if key(result) not in baseline_results:
+            continue
+        before = baseline_results[key(result)]
+        changes = []
+        for metric, higher_is_better in METRICS.items():
+            if not before.get(metric) or metric not in result:
+                continue
+            change = result[metric] / before[metric] - 1
+            worse = -change if higher_is_better else change
+            flag = ''
+            noisy = metric.endswith('_seconds') and max(before[metric], result[metric]) < args.min_seconds
+            if worse > args.threshold and not noisy:
+                flag = ' REGRESSION'
+                regressions += 1
+            changes.append('{} {:+.1%}{}'.format(metric, change, flag))
+        print('v={} n={} delta={} x{}: {}'.format(*key(result), ', '.join(changes)))
+
+    print('{} regression(s) over {:.0%}'.format(regressions, args.threshold))
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+"""
+Sends the tweets of a test file to a running `nlp.py serve` from concurrent connections, then reports
+the latency seen by the clients, the throughput, the accuracy and the stats of the server.
+
+usage: python benchmarks/load_generator.py [--host HOST] [--port PORT | --unix PATH] [--connections N]
+                                           [--pipeline N] [--requests N] [testing_file]
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from records import iter_records, open_lines  # noqa: E402
+
+DEFAULT_TESTING_FILE = 'input/test-tweets-given.txt'
+
+
+async def connect(args):
+    if args.unix:
+        return await asyncio.open_unix_connection(args.unix)
+    return await asyncio.open_connection(args.host, args.port)
+
+
+async def client(args, records, latencies, correct):
+    """
+    Keeps up to args.pipeline requests in flight on one connection, responses come back in order
+    """
+    reader, writer = await connect(args)
+    in_flight = asyncio.Queue(args.pipeline)
+
+    async def receive():
+        while True:
+            item = await in_flight.get()
+            if item is None:
+                return
+            record, sent = item
+            response = json.loads(await reader.readline())
+            latencies.append(time.perf_counter() - sent)
+            correct.append(response.get('language') == record.language)
+
+    receiver = asyncio.ensure_future(receive())
+    for record in records:
+        await in_flight.put((record, time.perf_counter()))
+        writer.write((json.dumps({'id': record.tweet_id, 'tweet': record.content}) + '\n').encode('utf-8'))
+        await writer.drain()
+    await in_flight.put(None)
+    await receiver
+    writer.close()
+
+
+async def server_stats(args):
+    reader, writer = await connect(args)
+    writer.write(b'{"stats": true}\n')
+    stats = json.loads(await reader.readline())
+    writer.close()
+    return stats
+
+
+async def run(args, records):
+    latencies = []
+    correct = []
+    start = time.perf_counter()
+    await asyncio.gather(*[client(args, records[connection::args.connections], latencies, correct)
+                           for connection in range(args.connections)])
+    elapsed = time.perf_counter() - start
+
+    p50, p99 = np.percentile(latencies, [50, 99]).tolist()
+    print('{} requests on {} connections in {:.2f}s: {:.0f} requests/s, p50 {:.2f}ms, p99 {:.2f}ms, '
+          'accuracy {:.4f}'.format(len(latencies), args.connections, elapsed, len(latencies) / elapsed,
+                                   p50 * 1000, p99 * 1000, sum(correct) / len(correct)))
+    print('server: {}'.format(json.dumps(await server_stats(args))))
+
+
+def main():
+    argument_parser = argparse.ArgumentParser(description='Load generator for nlp.py serve')
+    argument_parser.add_argument('testing_file', nargs='?', default=DEFAULT_TESTING_FILE)
+    argument_parser.add_argument('--host', default='127.0.0.1')
+    argument_parser.add_argument('--port', type=int, default=8472)
+    argument_parser.add_argument('--unix', help='Path of the Unix socket of the server, instead of TCP')
+    argument_parser.add_argument('--connections', type=int, default=16)
+    argument_parser.add_argument('--pipeline', type=int, default=8, help='Requests in flight per connection')
+    argument_parser.add_argument('--requests', type=int, default=0, help='Number of requests, 0 for every tweet')
+    args = argument_parser.parse_args()
+
+    with open_lines(args.testing_file) as lines:
+        records = list(iter_records(lines, lambda line: None))
+    if args.requests > 0:
+        records = (records * (args.requests // len(records) + 1))[:args.requests]
+    asyncio.run(run(args, records))
+
+
+if __name__ == '__main__':
+    main()
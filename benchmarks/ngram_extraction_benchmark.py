@@ -0,0 +1,112 @@
+"""
+Measures with tracemalloc the memory allocated per tweet by n-gram extraction, comparing the
+integer codes of NgramModel.iter_codes() to the list of substrings the models used to build,
+when training and when scoring a tweet against every language.
+
+usage: python benchmarks/ngram_extraction_benchmark.py [training_file] [testing_file]
+"""
+import io
+import os
+import sys
+import time
+import tracemalloc
+from contextlib import redirect_stdout
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from language import LANGUAGES  # noqa: E402
+from parser import NgramTrainingDataParser  # noqa: E402
+from records import iter_records, open_lines  # noqa: E402
+from training import NgramTrainingModel  # noqa: E402
+
+DEFAULT_TRAINING_FILE = 'input/training-tweets.txt'
+DEFAULT_TESTING_FILE = 'input/test-tweets-given.txt'
+CONFIGS = [(1, 3, 'dense'), (1, 3, 'sparse'), (2, 3, 'sparse')]  # (vocabulary, ngram size, storage)
+SMOOTHING = 0.5
+TWEET_COUNT = 2000
+
+
+def substrings(tweet, n):
+    """
+    Every n-gram of a tweet as a list of substrings
+    """
+    return list(tweet[j:j + n] for j in range(0, len(tweet) - (n - 1)))
+
+
+def train_substrings(model, tweet):
+    model.ngram_model.insert(substrings(tweet, model.ngram_model.n))
+
+
+def train_codes(model, tweet):
+    model.ngram_model.insert_text(tweet)
+
+
+def test_substrings(model, tweet):
+    score = model.prior
+    for ngram in substrings(tweet, model.ngram_model.n):
+        if model.ngram_model.in_vocab(ngram, False):
+            score += model.ngram_model.get_prob(ngram, model.probabilities)
+        else:
+            score += model.non_existing_char_prob
+    return score
+
+
+def test_codes(model, tweet):
+    return model.test(tweet)
+
+
+def allocations(step, models, tweets):
+    """
+    Mean and max over tweets of the peak memory allocated by step() over every model
+    """
+    peaks = []
+    tracemalloc.start()
+    for tweet in tweets:
+        tracemalloc.reset_peak()
+        current = tracemalloc.get_traced_memory()[0]
+        for model in models:
+            step(model, tweet)
+        peaks.append(tracemalloc.get_traced_memory()[1] - current)
+    tracemalloc.stop()
+    return sum(peaks) / len(peaks), max(peaks)
+
+
+def elapsed(step, models, tweets):
+    start = time.perf_counter()
+    for tweet in tweets:
+        for model in models:
+            step(model, tweet)
+    return time.perf_counter() - start
+
+
+def trained_parser(training_file, vocabulary, n, storage):
+    with redirect_stdout(io.StringIO()):
+        parser = NgramTrainingDataParser(training_file, n, vocabulary, SMOOTHING, storage)
+        parser.parse()
+    return parser
+
+
+def main():
+    training_file = sys.argv[1] if len(sys.argv) > 1 else DEFAULT_TRAINING_FILE
+    testing_file = sys.argv[2] if len(sys.argv) > 2 else DEFAULT_TESTING_FILE
+    with open_lines(testing_file) as lines:
+        tweets = [record.content for record in iter_records(lines, lambda line: None)][:TWEET_COUNT]
+
+    for vocabulary, n, storage in CONFIGS:
+        parser = trained_parser(training_file, vocabulary, n, storage)
+        scoring_models = [parser.models[language] for language in LANGUAGES]
+        print('vocab {} n {} {}:'.format(vocabulary, n, storage))
+        for stage, steps, models in [
+            ('training', [('substrings', train_substrings), ('codes', train_codes)],
+             lambda: [NgramTrainingModel(LANGUAGES[0], parser._build_ngram_model())]),
+            ('scoring', [('substrings', test_substrings), ('codes', test_codes)], lambda: scoring_models)
+        ]:
+            for name, step in steps:
+                mean_peak, max_peak = allocations(step, models(), tweets)
+                seconds = elapsed(step, models(), tweets)
+                print('  {} {:<10}: peak {:7.0f} B/tweet on average, {:6d} B at most, {:.0f} tweets/s'.format(
+                    stage, name, mean_peak, max_peak, len(tweets) / seconds))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+"""
+Compares the tokenizers of nlp_tools.tokenizers on a test file: throughput, agreement of the words
+kept by the tf-idf model, and classification accuracy of the BYOM model trained with each of them.
+
+usage: python benchmarks/tokenizer_benchmark.py [training_file] [testing_file]
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from language import LANGUAGES  # noqa: E402
+from nlp_tools.tokenizers import TOKENIZERS  # noqa: E402
+from parser import TFIDFWithStopWordTrainingParser  # noqa: E402
+from records import iter_records, open_lines  # noqa: E402
+from training import BLACKLIST_SET  # noqa: E402
+
+DEFAULT_TRAINING_FILE = 'input/training-tweets.txt'
+DEFAULT_TESTING_FILE = 'input/test-tweets-given.txt'
+REPEAT = 3
+
+
+def kept_words(tokens):
+    """
+    Words TFIDFWithStopWordTrainingModel.insert() would keep
+    """
+    return [token.lower() for token in tokens
+            if token.isalnum() and len(token) != 1 and token.lower() not in BLACKLIST_SET]
+
+
+def throughput(tokenize, tweets):
+    best = None
+    token_count = 0
+    for _ in range(REPEAT):
+        start = time.perf_counter()
+        token_count = sum(len(tokenize(tweet)) for tweet in tweets)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return len(tweets) / best, token_count / best
+
+
+def accuracy(tokenizer, training_file, records):
+    training_parser = TFIDFWithStopWordTrainingParser(training_file, tokenizer)
+    training_parser.parse()
+    scores = training_parser.score_batch([record.content for record in records])
+    guesses = scores.argmax(axis=1)
+    return sum(LANGUAGES[guess] == record.language for guess, record in zip(guesses, records)) / len(records)
+
+
+def main():
+    training_file = sys.argv[1] if len(sys.argv) > 1 else DEFAULT_TRAINING_FILE
+    testing_file = sys.argv[2] if len(sys.argv) > 2 else DEFAULT_TESTING_FILE
+    with open_lines(testing_file) as lines:
+        records = list(iter_records(lines, lambda line: None))
+    tweets = [record.content for record in records]
+
+    available = {}
+    for name, tokenize in TOKENIZERS.items():
+        try:
+            tokenize('probe')
+            available[name] = tokenize
+        except LookupError as e:
+            reason = next(line.strip() for line in str(e).splitlines() if line.strip('* '))
+            print('{}: unavailable ({})'.format(name, reason))
+
+    for name, tokenize in available.items():
+        tweets_per_s, tokens_per_s = throughput(tokenize, tweets)
+        print('{}: {:.0f} tweets/s, {:.0f} tokens/s, accuracy {:.4f}'.format(
+            name, tweets_per_s, tokens_per_s, accuracy(name, training_file, records)))
+
+    if 'nltk' in available:
+        for name, tokenize in available.items():
+            if name == 'nltk':
+                continue
+            same = sum(kept_words(tokenize(tweet)) == kept_words(available['nltk'](tweet)) for tweet in tweets)
+            print('{}: same words as nltk for {:.2%} of tweets'.format(name, same / len(tweets)))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,4 +1,7 @@
+from functools import lru_cache
+
 import string
+import unicodedata
 
 LANGUAGES = ['eu', 'ca', 'gl', 'es', 'en', 'pt']
 
@@ -11,7 +14,31 @@ LANGUAGE_DICT = {
     'pt': 'portuguese'
 }
 
+# Number of codepoints accepted by built-in isalpha(), keyed by unicodedata.unidata_version
+# (generated with CPython 3.6 to 3.13)
+IS_ALPHA_COUNTS = {
+    '9.0.0': 116766,
+    '11.0.0': 125419,
+    '12.1.0': 125643,
+    '13.0.0': 131241,
+    '14.0.0': 131756,
+    '15.0.0': 136104,
+    '15.1.0': 136726,
+}
+
 
 def add_alphabet_to_ocurrence_dict(is_uppercase: bool, occ_dict):
     for letter in string.ascii_uppercase if is_uppercase else string.ascii_lowercase:
         occ_dict[letter] = 0
+
+
+@lru_cache(maxsize=None)
+def is_alpha_count() -> int:
+    """
+    Returns the number of unicode characters accepted by built-in isalpha().
+    Looked up from the precomputed table, only scans the 17 planes of 2**16 symbols
+    once per process for an unknown unicode version
+    """
+    if unicodedata.unidata_version in IS_ALPHA_COUNTS:
+        return IS_ALPHA_COUNTS[unicodedata.unidata_version]
+    return sum(1 for codepoint in range(17 * 2 ** 16) if chr(codepoint).isalpha())
@@ -0,0 +1,134 @@
+from collections import Counter
+from contextlib import contextmanager
+from typing import Dict, Optional
+
+import json
+import os
+import sys
+import time
+
+try:
+    import resource
+except ImportError:  # not available on Windows, peak RSS is then left out
+    resource = None
+
+# counter -> stage whose wall time gives its throughput
+THROUGHPUTS = {
+    'tweets_ingested': 'training',
+    'tweets_scored': 'testing'
+}
+
+
+def _children_cpu_time() -> float:
+    if resource is None:
+        return 0.0
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+def _peak_rss_mb(who) -> Optional[float]:
+    if resource is None:
+        return None
+    # kilobytes on Linux, bytes on macOS
+    peak = resource.getrusage(who).ru_maxrss
+    return peak / (1 << 20) if sys.platform == 'darwin' else peak / 1024
+
+
+class Metrics:
+    """
+    Wall and CPU time of the stages of a run, and counters. Disabled by default, stage() and count() then
+    do nothing. CPU time includes the worker processes that ended during the stage
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.stages: Dict[str, Dict[str, float]] = {}
+        self.counters = Counter()
+        self.start = time.perf_counter()
+
+    def enable(self):
+        self.enabled = True
+        self.start = time.perf_counter()
+
+    @contextmanager
+    def stage(self, name: str):
+        """
+        Times the wrapped block, nested stages are named 'stage/substage' by convention
+        """
+        if not self.enabled:
+            yield
+            return
+
+        wall = time.perf_counter()
+        cpu = time.process_time() + _children_cpu_time()
+        try:
+            yield
+        finally:
+            stage = self.stages.setdefault(name, {'calls': 0, 'wall_seconds': 0.0, 'cpu_seconds': 0.0})
+            stage['calls'] += 1
+            stage['wall_seconds'] += time.perf_counter() - wall
+            stage['cpu_seconds'] += time.process_time() + _children_cpu_time() - cpu
+
+    def count(self, name: str, value: int = 1):
+        if self.enabled:
+            self.counters[name] += value
+
+    def take_counters(self) -> Counter:
+        """
+        Returns the counters and starts new ones, for a worker process to send them back
+        """
+        counters = self.counters
+        self.counters = Counter()
+        return counters
+
+    def add_counters(self, counters: Counter):
+        if self.enabled:
+            self.counters.update(counters)
+
+    def report(self) -> dict:
+        throughputs = {}
+        for counter, stage in THROUGHPUTS.items():
+            if counter in self.counters and self.stages.get(stage, {}).get('wall_seconds'):
+                throughputs['{}_per_s'.format(counter)] = self.counters[counter] / self.stages[stage]['wall_seconds']
+        return {
+            'wall_seconds': time.perf_counter() - self.start,
+            'stages': self.stages,
+            'counters': dict(self.counters),
+            'throughputs': throughputs,
+            'peak_rss_mb': _peak_rss_mb(resource.RUSAGE_SELF) if resource is not None else None,
+            'children_peak_rss_mb': _peak_rss_mb(resource.RUSAGE_CHILDREN) if resource is not None else None
+        }
+
+    def write(self, path: str):
+        with open(path, 'w') as f:
+            json.dump(self.report(), f, indent=2)
+
+
+# metrics of the current process
+METRICS = Metrics()
+if hasattr(os, 'register_at_fork'):
+    # worker processes send back only what they counted themselves, see take_counters()
+    os.register_at_fork(after_in_child=METRICS.take_counters)
+
+
+@contextmanager
+def instrumented(metrics_path: Optional[str] = None, profile_path: Optional[str] = None):
+    """
+    Records METRICS into a JSON report at metrics_path, and profiles with cProfile into a pstats dump at
+    profile_path, when given
+    """
+    profiler = None
+    if metrics_path:
+        METRICS.enable()
+    if profile_path:
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+    try:
+        yield METRICS
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(profile_path)
+        if metrics_path:
+            METRICS.write(metrics_path)
@@ -1,18 +1,45 @@
 from abc import ABC, abstractmethod
 from language import add_alphabet_to_ocurrence_dict
-from typing import List
+from typing import Dict, Iterator, List, Tuple
+
+import numpy as np
+import re
+
+INVALID_CHAR = '\x00'  # replaces the characters outside of the vocabulary
+VALID_RUN_PATTERN = re.compile('[^{}]+'.format(INVALID_CHAR))
 
 
 class CharNotInVocabularyException(Exception):
     pass
 
 
+class VocabularyTable(dict):
+    """
+    str.translate() table keeping the characters of the corpus, and any isalpha() character when
+    accept_alpha, while replacing the others with INVALID_CHAR. Each character is checked once
+    """
+
+    def __init__(self, corpus: dict, accept_alpha: bool):
+        super(VocabularyTable, self).__init__()
+        self.corpus = corpus
+        self.accept_alpha = accept_alpha
+
+    def __missing__(self, codepoint: int):
+        char = chr(codepoint)
+        value = char if char in self.corpus or (self.accept_alpha and char.isalpha()) else INVALID_CHAR
+        self[codepoint] = value
+        return value
+
+
 class NgramModel(ABC):
-    def __init__(self, vocab: int):
-        self.n = 0
+    def __init__(self, vocab: int, n: int):
+        self.n = n
         self.corpus = {}
         self.vocab = vocab
         self.extra_vocab_chars = set()
+        self.rejected = 0  # n-grams dismissed by insert()
+        self.rejected_ngrams = None  # set to a Counter to also count each dismissed n-gram
+        self._vocab_tables = {}  # VocabularyTable for updating and for non-updating checks
         self._build_corpus()
 
     def _build_one_level_vocab(self, target_dict):
@@ -29,28 +56,144 @@ class NgramModel(ABC):
             for char in self.extra_vocab_chars:
                 target_dict[char] = 0
 
-    def vocab_safe_check(self, ngram: str, update=True):
+    def in_vocab(self, ngram: str, update=True) -> bool:
         """
-        Checks whether or not an n-gram can be inserted into the corpus
+        Whether or not an n-gram can be inserted into the corpus
         Updating the corpus with a new char can be optionally ignores
-        Raises CharNotInVocabularyException if not possible.
         """
-        if self.vocab == 0 or self.vocab == 1:
+        if self.vocab == 2:
             for char in ngram:
-                # checking first level is sufficient, corpus already populated
-                # with correct alphabet
                 if char not in self.corpus:
-                    raise CharNotInVocabularyException('Dismiss for vocab {}: "{}"'.format(self.vocab, ngram))
-        elif self.vocab == 2:
-            for char in ngram:
-                if char.isalpha():
-                    if char not in self.corpus and update:
-                        self.extra_vocab_chars.add(char)
-                        self._spread_new_vocab_char(char)
-                    elif char not in self.corpus:
-                        raise CharNotInVocabularyException('Dismiss for vocab {}: "{}"'.format(self.vocab, ngram))
-                else:
-                    raise CharNotInVocabularyException('Dismiss for vocab {}: "{}"'.format(self.vocab, ngram))
+                    if not update or not char.isalpha():
+                        return False
+                    self._add_vocab_char(char)
+            return True
+
+        for char in ngram:
+            # checking first level is sufficient, corpus already populated
+            # with correct alphabet
+            if char not in self.corpus:
+                return False
+        return True
+
+    def _add_vocab_char(self, char: str):
+        self.extra_vocab_chars.add(char)
+        self._spread_new_vocab_char(char)
+        # characters rejected so far by the non-updating table may now be valid
+        self._vocab_tables.pop(False, None)
+
+    def vocabulary_text(self, text: str, update=True) -> str:
+        """
+        Maps text once through the vocabulary table, replacing the characters outside of the vocabulary with
+        INVALID_CHAR. The updating table of vocab 2 accepts any isalpha() character, the mapped text then
+        does not depend on n nor on the characters added so far
+        """
+        if update not in self._vocab_tables:
+            self._vocab_tables[update] = VocabularyTable(self.corpus, update and self.vocab == 2)
+        return text.translate(self._vocab_tables[update])
+
+    def vocabulary_runs(self, text: str, update=True) -> List[Tuple[int, str]]:
+        """
+        (start, run) for every run of consecutive characters of the vocabulary in text, where n-grams never
+        need checking
+        """
+        return [(match.start(), match.group())
+                for match in VALID_RUN_PATTERN.finditer(self.vocabulary_text(text, update))]
+
+    def add_run_chars(self, text: str, runs: List[Tuple[int, str]]):
+        """
+        Adds the new characters of vocab 2 of the runs of text like in_vocab() over every n-gram of text would
+        """
+        if self.vocab != 2:
+            return
+        last_ngram_start = len(text) - self.n
+        for start, run in runs:
+            # in_vocab() goes through the characters of an n-gram until an invalid one, every character
+            # of a run holding the start of an n-gram gets checked
+            if start <= last_ngram_start:
+                for char in run:
+                    if char not in self.corpus:
+                        self._add_vocab_char(char)
+
+    def valid_runs(self, text: str, update=True) -> List[Tuple[int, str]]:
+        """
+        vocabulary_runs() of text. Updating adds the new characters of vocab 2 first, see add_run_chars()
+        """
+        runs = self.vocabulary_runs(text, update)
+        if update:
+            self.add_run_chars(text, runs)
+        return runs
+
+    def insert_text(self, text: str):
+        """
+        Inserts every n-gram of text made of vocabulary characters, returns the amount of ngrams inserted
+        """
+        # runs are listed first, new characters of vocab 2 may change the radix of the codes
+        runs = self.valid_runs(text)
+        radix = self._counts_radix()
+        return self.insert_codes(text, runs, [code for _, run in runs for code in self.iter_codes(run, radix)])
+
+    def insert_codes(self, text: str, runs: List[Tuple[int, str]], codes: List[int]):
+        """
+        insert_text() of the codes of the n-grams of text, already extracted from its runs, after
+        add_run_chars(). Returns the amount of ngrams inserted
+        """
+        for code in codes:
+            self._insert_code(code)
+        self._count_rejected(text, runs, len(codes))
+        return len(codes)
+
+    def shares_encoding(self, other: 'NgramModel') -> bool:
+        """
+        Whether other always encodes characters into the same codes, in the same radix, as this model
+        """
+        return False
+
+    def _count_rejected(self, text: str, runs: List[Tuple[int, str]], count: int):
+        """
+        Counts the n-grams of text outside of its runs as dismissed
+        """
+        self.rejected += max(len(text) - self.n + 1, 0) - count
+        if self.rejected_ngrams is not None:
+            valid = set()
+            for start, run in runs:
+                valid.update(range(start, start + len(run) - self.n + 1))
+            for j in range(len(text) - self.n + 1):
+                if j not in valid:
+                    self.rejected_ngrams[text[j:j + self.n]] += 1
+
+    def iter_codes(self, run: str, radix: int) -> Iterator[int]:
+        """
+        Yields the integer code c1 * radix^(n-1) + ... + cn of every n-gram of a run of vocabulary
+        characters, rolled from one n-gram to the next over the character codes of the run
+        instead of slicing it
+        """
+        n = self.n
+        if len(run) < n:
+            # holds no n-gram, its new characters of vocab 2 may not be in the corpus
+            return
+        top = radix ** (n - 1)
+        chars = self._encode(run)
+        code = 0
+        for position, char in enumerate(chars):
+            if position >= n:
+                code -= chars[position - n] * top
+            code = code * radix + char
+            if position >= n - 1:
+                yield code
+
+    def vocab_safe_check(self, ngram: str, update=True):
+        """
+        Checks whether or not an n-gram can be inserted into the corpus
+        Raises CharNotInVocabularyException if not possible.
+        """
+        if not self.in_vocab(ngram, update):
+            raise CharNotInVocabularyException('Dismiss for vocab {}: "{}"'.format(self.vocab, ngram))
+
+    def _reject(self, ngram: str):
+        self.rejected += 1
+        if self.rejected_ngrams is not None:
+            self.rejected_ngrams[ngram] += 1
 
     def insert(self, ngrams: List[str]):
         """
@@ -58,13 +201,11 @@ class NgramModel(ABC):
         """
         count = 0
         for ngram in ngrams:
-            try:
-                self.vocab_safe_check(ngram)
+            if self.in_vocab(ngram):
                 self._insert_ngram(ngram)
                 count += 1
-            except CharNotInVocabularyException as e:
-                print(e)
-                continue
+            else:
+                self._reject(ngram)
         return count
 
     @abstractmethod
@@ -88,135 +229,647 @@ class NgramModel(ABC):
         """
         pass
 
-    @staticmethod
     @abstractmethod
-    def get_prob(ngram: str, probabilities):
+    def _encode(self, run: str) -> List[int]:
         """
-        Defines how to access a corpusfor an n-gram
+        Codes of the characters of a run, the digits of the codes yielded by iter_codes()
+        """
+        pass
+
+    @abstractmethod
+    def _encode_text(self, text: str, invalid_code: int) -> List[int]:
+        """
+        _encode() of a text mapped by vocabulary_text(), its INVALID_CHAR characters getting invalid_code
+        """
+        pass
+
+    @abstractmethod
+    def _counts_radix(self) -> int:
         """
+        Radix of the codes read by _insert_code()
+        """
+        pass
+
+    @abstractmethod
+    def _insert_code(self, code: int):
+        """
+        Inserts an n-gram given as a code of iter_codes()
+        """
+        pass
+
+    @abstractmethod
+    def code_lookup(self, probabilities):
+        """
+        Returns (radix, table), table[code] being the probability of the n-gram coded by iter_codes()
+        with that radix
+        """
+        pass
+
+    @abstractmethod
+    def add_code_probs(self, score: float, codes: List[int], table, missing: float) -> float:
+        """
+        Adds the probabilities of codes in table, as given by code_lookup(), to score one after the other.
+        Code -1 gets the missing value
+        """
+        pass
+
+    @abstractmethod
+    def get_prob(self, ngram: str, probabilities):
+        """
+        Defines how to access a corpus for an n-gram
+        """
+        pass
+
+    @abstractmethod
+    def get_probs(self, alphabet: List[str], windows: np.ndarray, probabilities, missing: float):
+        """
+        Vectorized get_prob() over windows, an array of shape [count, n] holding n-grams as indices
+        into alphabet. N-grams with a character outside of the corpus get the missing value
+        """
+        pass
+
+    @abstractmethod
+    def compute_probabilities(self, prob_value):
+        """
+        Maps every occurence count of the corpus through prob_value, in the layout read by get_prob()
+        """
+        pass
+
+    def compute_probabilities_many(self, prob_values: List) -> List:
+        """
+        compute_probabilities() for several prob_value functions at once, sharing the work that does not
+        depend on them
+        """
+        return [self.compute_probabilities(prob_value) for prob_value in prob_values]
+
+    def merge(self, other: 'NgramModel'):
+        """
+        Adds the occurences counted by other, an n-gram model of the same kind, vocab and n.
+        Characters of vocab 2 seen only by other are added to the vocabulary first
+        """
+        for char in other.corpus:
+            if char not in self.corpus:
+                self._add_vocab_char(char)
+        self._merge_counts(other)
+
+        self.rejected += other.rejected
+        if self.rejected_ngrams is not None and other.rejected_ngrams is not None:
+            self.rejected_ngrams.update(other.rejected_ngrams)
+
+    def __iadd__(self, other: 'NgramModel'):
+        self.merge(other)
+        return self
+
+    @abstractmethod
+    def _merge_counts(self, other: 'NgramModel'):
+        """
+        Adds the counts of other, whose whole vocabulary is already in the corpus
+        """
+        pass
+
+    def export(self, probabilities):
+        """
+        Returns the vocabulary to store in a model file header, and the arrays to store after it
+        """
+        return {'corpus': list(self.corpus), 'extra_vocab_chars': sorted(self.extra_vocab_chars)}, \
+            self._export_arrays(probabilities)
+
+    def restore(self, meta: dict, arrays: Dict[str, np.ndarray]):
+        """
+        Restores the corpus saved by export(), returns the probabilities
+        """
+        self.extra_vocab_chars = set(meta['extra_vocab_chars'])
+        self._vocab_tables = {}
+        return self._restore_arrays(meta['corpus'], arrays)
+
+    @abstractmethod
+    def _export_arrays(self, probabilities) -> Dict[str, np.ndarray]:
         pass
 
+    @abstractmethod
+    def _restore_arrays(self, corpus_chars: List[str], arrays: Dict[str, np.ndarray]):
+        pass
 
-class UnigramModel(NgramModel):
+
+class DenseNgramModel(NgramModel):
     """
-    Bag of words (or character in this case)
+    n-gram occurences held in a contiguous array, with one axis per character of the n-gram.
+    The corpus maps every character of the vocabulary to its index on each axis.
 
     corpus = {
-        'a': 8,
-        'b': 5,
-        'c': 19,
+        'a': 0,
+        'b': 1,
+        'c': 2,
         [...]
     }
+
+    counts[corpus['a'], corpus['b'], [...]] = 8
     """
 
-    def __init__(self, vocab: int):
-        super(UnigramModel, self).__init__(vocab)
-        self.n = 1
-        pass
+    def __init__(self, vocab: int, n: int):
+        self.counts = np.zeros(0, dtype=np.int32)
+        self._pending = []  # flat indices of inserted n-grams not yet added to counts
+        super(DenseNgramModel, self).__init__(vocab, n)
+
+    def _indices(self, ngram: str):
+        return tuple(self.corpus[char] for char in ngram)
+
+    def _flat_index(self, ngram: str):
+        capacity = self.counts.shape[0]
+        index = 0
+        for char in ngram:
+            index = index * capacity + self.corpus[char]
+        return index
+
+    def _flush(self):
+        """
+        Adds the pending n-grams to the counts
+        """
+        if self._pending:
+            self.counts += np.bincount(self._pending, minlength=self.counts.size) \
+                .reshape(self.counts.shape).astype(np.int32)
+            self._pending = []
+
+    def vocab_counts(self):
+        """
+        View of the counts restricted to the characters of the vocabulary
+        """
+        self._flush()
+        return self.counts[(slice(0, len(self.corpus)),) * self.n]
 
     def _build_corpus(self):
         self._build_one_level_vocab(self.corpus)
+        for index, char in enumerate(self.corpus):
+            self.corpus[char] = index
+        self.counts = np.zeros((len(self.corpus),) * self.n, dtype=np.int32)
 
     def _spread_new_vocab_char(self, char: str):
-        self.corpus[char] = 0
+        index = len(self.corpus)
+        self.corpus[char] = index
+        capacity = self.counts.shape[0]
+        if index < capacity:
+            return
+
+        # flat indices depend on the capacity
+        self._flush()
+        # grows by a quarter at a time, vocab 2 only sees a handful of new characters per script
+        grown = np.zeros((max(index + 1, capacity + capacity // 4),) * self.n, dtype=np.int32)
+        grown[(slice(0, capacity),) * self.n] = self.counts
+        self.counts = grown
+
+    def _insert_ngram(self, ngram: str):
+        self._pending.append(self._flat_index(ngram))
+
+    def _encode(self, run: str):
+        corpus = self.corpus
+        return [corpus[char] for char in run]
+
+    def _encode_text(self, text: str, invalid_code: int):
+        get = self.corpus.get
+        return [get(char, invalid_code) for char in text]
+
+    def _counts_radix(self):
+        # codes in this radix are flat indices into counts
+        return self.counts.shape[0]
+
+    def _insert_code(self, code: int):
+        self._pending.append(code)
+
+    def insert(self, ngrams: List[str]):
+        """
+        Inserts if possible an ngram in the corpus, returns the amount of ngrams inserted
+        """
+        count = 0
+        for ngram in ngrams:
+            if self.in_vocab(ngram):
+                self._pending.append(self._flat_index(ngram))
+                count += 1
+            else:
+                self._reject(ngram)
+
+        if len(self._pending) >= 1 << 16:
+            self._flush()
+        return count
+
+    def insert_codes(self, text: str, runs: List[Tuple[int, str]], codes: List[int]):
+        self._pending.extend(codes)
+        self._count_rejected(text, runs, len(codes))
+        if len(self._pending) >= 1 << 16:
+            self._flush()
+        return len(codes)
+
+    def shares_encoding(self, other: NgramModel):
+        # the corpus of vocab 0 and 1 is the same fixed alphabet, vocab 2 indexes characters as they come
+        return isinstance(other, DenseNgramModel) and self.vocab == other.vocab != 2
+
+    def code_lookup(self, probabilities: np.ndarray):
+        return probabilities.shape[0], probabilities.reshape(-1)
+
+    def add_code_probs(self, score: float, codes: List[int], table: np.ndarray, missing: float):
+        for code in codes:
+            score += table[code] if code >= 0 else missing
+        return score
+
+    def get_prob(self, ngram: str, probabilities):
+        return probabilities[self._indices(ngram)]
+
+    def get_probs(self, alphabet: List[str], windows: np.ndarray, probabilities, missing: float):
+        lookup = np.array([self.corpus.get(char, -1) for char in alphabet], dtype=np.int64)
+        indices = lookup[windows]
+        known = (indices >= 0).all(axis=1)
+        values = np.full(len(windows), missing, dtype=np.float64)
+        values[known] = probabilities[tuple(indices[known].T)]
+        return values
+
+    def compute_probabilities(self, prob_value):
+        return self.compute_probabilities_many([prob_value])[0]
+
+    def compute_probabilities_many(self, prob_values: List):
+        if not prob_values:
+            return []
+        counts = self.vocab_counts()
+        occurences, inverse = np.unique(counts, return_inverse=True)
+        # few distinct occurences, map them through prob_value to keep its exact float values
+        values = np.array([[prob_value(int(occurence)) for occurence in occurences] for prob_value in prob_values],
+                          dtype=np.float64)
+        return list(values[:, inverse.reshape(-1)].reshape((len(prob_values),) + counts.shape))
+
+    def _merge_counts(self, other: 'DenseNgramModel'):
+        # other indexes its characters in the order it met them
+        mapping = np.array([self.corpus[char] for char in other.corpus], dtype=np.int64)
+        other_counts = other.vocab_counts()
+        self._flush()
+        self.counts[np.ix_(*[mapping] * self.n)] += other_counts
+
+    def _export_arrays(self, probabilities):
+        return {'counts': self.vocab_counts(), 'probabilities': probabilities}
+
+    def _restore_arrays(self, corpus_chars: List[str], arrays: Dict[str, np.ndarray]):
+        # corpus keys are kept in index order
+        self.corpus = {char: index for index, char in enumerate(corpus_chars)}
+        self.counts = arrays['counts']
+        self._pending = []
+        return arrays['probabilities']
+
+
+class UnigramModel(DenseNgramModel):
+    """
+    Bag of words (or character in this case)
 
-    def _insert_ngram(self, char: str):
-        self.corpus[char] += 1
+    counts = [8, 5, 19, [...]]
+    """
 
-    @staticmethod
-    def get_prob(ngram: str, probabilities):
-        return probabilities[ngram[0]]
+    def __init__(self, vocab: int):
+        super(UnigramModel, self).__init__(vocab, 1)
 
 
-class BigramModel(NgramModel):
+class BigramModel(DenseNgramModel):
     """
     First-order Markov model
 
-    corpus = {
-        'a': {
-            'a': 8,
-            'b': 5,
-            'c': 19,
+    counts = [
+        [8, 5, 19, [...]],
+        [...]
+    ]
+    """
+
+    def __init__(self, vocab: int):
+        super(BigramModel, self).__init__(vocab, 2)
+
+
+class TrigramModel(DenseNgramModel):
+    """
+    Second-order Markov model
+
+    counts = [
+        [
+            [8, 5, 19, [...]],
             [...]
-        },
+        ],
         [...]
-    }
+    ]
     """
 
     def __init__(self, vocab: int):
-        super(BigramModel, self).__init__(vocab)
-        self.n = 2
-        pass
+        super(TrigramModel, self).__init__(vocab, 3)
 
-    def _build_corpus(self):
-        self._build_one_level_vocab(self.corpus)
-        for char in self.corpus:
-            self.corpus[char] = {}
-            self._build_one_level_vocab(self.corpus[char])
 
-    def _spread_new_vocab_char(self, char: str):
-        self.corpus[char] = {}
-        self._build_one_level_vocab(self.corpus[char])
+def _find_codes(sorted_codes: np.ndarray, codes: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Positions of codes in sorted_codes, where they would be inserted when missing, and whether they are there
+    """
+    positions = np.searchsorted(sorted_codes, codes)
+    if not len(sorted_codes):
+        return positions, np.zeros(len(codes), dtype=bool)
+    return positions, sorted_codes[np.minimum(positions, len(sorted_codes) - 1)] == codes
 
-        for char_1 in self.corpus:
-            self.corpus[char_1][char] = 0
 
-    def _insert_ngram(self, bigram: str):
-        self.corpus[bigram[0]][bigram[1]] += 1
+class SparseCounts:
+    """
+    Occurences of the codes seen by a SparseNgramModel, in arrays sorted by code for vectorized lookups.
+    Each code holds the rank of its occurence in occurences, the distinct occurences met in the order they
+    were, so that add() only rewrites the entries of the codes it counts
+    """
+
+    def __init__(self, codes: np.ndarray, occurences: np.ndarray):
+        distinct, ranks = np.unique(occurences, return_inverse=True)
+        self.codes = codes
+        self.ranks = ranks.astype(np.int32)
+        self.occurences: List[int] = distinct.tolist()
+        self._ranks = {occurence: rank for rank, occurence in enumerate(self.occurences)}
+
+    def __len__(self):
+        return len(self.codes)
 
-    @staticmethod
-    def get_prob(ngram: str, probabilities):
-        return probabilities[ngram[0]][ngram[1]]
+    def __getitem__(self, code: int) -> int:
+        position = int(np.searchsorted(self.codes, code))
+        if position < len(self.codes) and self.codes[position] == code:
+            return self.occurences[self.ranks[position]]
+        return 0
+
+    def occurence_array(self) -> np.ndarray:
+        """
+        Occurence of every code
+        """
+        return np.array(self.occurences, dtype=np.int64)[self.ranks]
 
+    def _rank(self, occurence: int) -> int:
+        rank = self._ranks.get(occurence)
+        if rank is None:
+            rank = self._ranks[occurence] = len(self.occurences)
+            self.occurences.append(occurence)
+        return rank
 
-class TrigramModel(NgramModel):
+    def add(self, counts: Dict[int, int]):
+        """
+        Adds counts, occurences per code, in O(len(counts) log len(self)) plus moving the arrays once to
+        insert the codes never seen
+        """
+        codes = np.fromiter(counts.keys(), dtype=np.int64, count=len(counts))
+        occurences = np.fromiter(counts.values(), dtype=np.int64, count=len(counts))
+        order = np.argsort(codes)
+        codes, occurences = codes[order], occurences[order]
+
+        positions, seen = _find_codes(self.codes, codes)
+        occurences[seen] += np.array([self.occurences[rank] for rank in self.ranks[positions[seen]].tolist()],
+                                     dtype=np.int64)
+        distinct, inverse = np.unique(occurences, return_inverse=True)
+        ranks = np.array([self._rank(occurence) for occurence in distinct.tolist()], dtype=np.int32)[inverse]
+        self.ranks[positions[seen]] = ranks[seen]
+        if not seen.all():
+            new = ~seen
+            self.codes = np.insert(self.codes, positions[new], codes[new])
+            self.ranks = np.insert(self.ranks, positions[new], ranks[new])
+
+
+class SparseProbabilities:
     """
-    Second-order Markov model
+    Probabilities read from the counts of a SparseNgramModel, without a copy of its codes.
+    prob_value() is called once per distinct occurence, n-grams never seen get unseen_value
+    """
+
+    def __init__(self, ngram_model: 'SparseNgramModel', prob_value):
+        self.ngram_model = ngram_model
+        self.prob_value = prob_value
+        self.unseen_value = prob_value(0)
+        self._values = {0: self.unseen_value}  # probability of each occurence met so far
+        self._table = np.zeros(0, dtype=np.float64)  # probability of each of SparseCounts.occurences
+
+    def __len__(self):
+        return len(self.ngram_model.sorted_counts())
+
+    def __getitem__(self, code: int):
+        return self._value(self.ngram_model.sorted_counts()[code])
+
+    def _value(self, occurence: int):
+        value = self._values.get(occurence)
+        if value is None:
+            value = self._values[occurence] = self.prob_value(occurence)
+        return value
+
+    def _counts_table(self) -> Tuple[SparseCounts, np.ndarray]:
+        """
+        Sorted counts of the model and the probability of each of their distinct occurences, the ones met
+        since the last call are computed
+        """
+        counts = self.ngram_model.sorted_counts()
+        if len(self._table) < len(counts.occurences):
+            added = [self._value(occurence) for occurence in counts.occurences[len(self._table):]]
+            self._table = np.append(self._table, np.array(added, dtype=np.float64))
+        return counts, self._table
+
+    def lookup(self, codes: np.ndarray) -> np.ndarray:
+        """
+        Probability of every code
+        """
+        counts, table = self._counts_table()
+        positions, seen = _find_codes(counts.codes, codes)
+        values = np.full(len(codes), self.unseen_value, dtype=np.float64)
+        values[seen] = table[counts.ranks[positions[seen]]]
+        return values
+
+    def sorted_counts(self):
+        """
+        Sorted codes, their occurences and their probabilities, as stored in model files
+        """
+        counts, table = self._counts_table()
+        return counts.codes, counts.occurence_array(), table[counts.ranks]
+
+
+class SortedSparseProbabilities:
+    """
+    Read-only SparseProbabilities backed by sorted code and probability arrays, as loaded from a model file
+    """
+
+    def __init__(self, codes: np.ndarray, occurences: np.ndarray, values: np.ndarray, unseen_value: float):
+        self.codes = codes
+        self.occurences = occurences
+        self.values = values
+        self.unseen_value = unseen_value
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __getitem__(self, code: int):
+        position = np.searchsorted(self.codes, code)
+        if position < len(self.codes) and self.codes[position] == code:
+            return self.values[position]
+        return self.unseen_value
+
+    def lookup(self, codes: np.ndarray) -> np.ndarray:
+        positions, seen = _find_codes(self.codes, codes)
+        values = np.full(len(codes), self.unseen_value, dtype=np.float64)
+        values[seen] = self.values[positions[seen]]
+        return values
+
+    def sorted_counts(self):
+        return self.codes, self.occurences, self.values
+
+
+class SparseNgramModel(NgramModel):
+    """
+    Only holds the n-grams actually seen, packed as one integer code made of the codepoints
+    of its characters (21 bits each). New characters of vocab 2 only extend the corpus.
 
     corpus = {
-        'a': {
-            'a': {
-                    'a': 8,
-                    'b': 5,
-                    'c': 19,
-                    [...]
-                },
-            [...]
-        },
+        'a': 0,
+        'b': 0,
+        [...]
+    }
+
+    counts = {
+        (ord('a') << 42) | (ord('b') << 21) | ord('c'): 8,
         [...]
     }
+
+    counts only holds the occurences counted since the last sorted_counts(), which adds them to the
+    SparseCounts read by lookups
     """
 
-    def __init__(self, vocab):
-        super(TrigramModel, self).__init__(vocab)
-        self.n = 3
+    CODEPOINT_BITS = 21
+
+    def __init__(self, vocab: int, n: int):
+        self.counts = {}
+        self._sorted: SparseCounts = None  # occurences counted before counts, see sorted_counts()
+        self._restored = None  # (codes, occurences) arrays of a model file, until sorted_counts() needs them
+        super(SparseNgramModel, self).__init__(vocab, n)
+
+    def sorted_counts(self) -> SparseCounts:
+        """
+        Every occurence counted, after adding counts to the sorted ones. A loaded model only builds them from
+        the arrays of its model file once an update needs them, scoring reads those arrays
+        """
+        if self._sorted is None:
+            codes, occurences = self._restored or (np.zeros(0, dtype=np.int64),) * 2
+            self._sorted = SparseCounts(codes, occurences)
+            self._restored = None
+        if self.counts:
+            self._sorted.add(self.counts)
+            self.counts = {}
+        return self._sorted
+
+    def _code(self, ngram: str):
+        code = 0
+        for char in ngram:
+            code = (code << self.CODEPOINT_BITS) | ord(char)
+        return code
 
     def _build_corpus(self):
         self._build_one_level_vocab(self.corpus)
-        for char_f in self.corpus:
-            self.corpus[char_f] = {}
-            self._build_one_level_vocab(self.corpus[char_f])
-            for char_s in self.corpus[char_f]:
-                self.corpus[char_f][char_s] = {}
-                self._build_one_level_vocab(self.corpus[char_f][char_s])
 
     def _spread_new_vocab_char(self, char: str):
-        self.corpus[char] = {}
-        self._build_one_level_vocab(self.corpus[char])
-        for char_2 in self.corpus[char]:
-            self.corpus[char][char_2] = {}
-            self._build_one_level_vocab(self.corpus[char][char_2])
-
-        for char_1 in self.corpus:
-            self.corpus[char_1][char] = {}
-            self._build_one_level_vocab(self.corpus[char_1][char])
-
-            for char_2 in self.corpus[char_1]:
-                self.corpus[char_1][char_2][char] = 0
-
-    def _insert_ngram(self, trigram: str):
-        self.corpus[trigram[0]][trigram[1]][trigram[2]] += 1
+        self.corpus[char] = 0
 
-    @staticmethod
-    def get_prob(ngram: str, probabilities):
-        return probabilities[ngram[0]][ngram[1]][ngram[2]]
+    def _insert_ngram(self, ngram: str):
+        self._insert_code(self._code(ngram))
+
+    def _encode(self, run: str):
+        return list(map(ord, run))
+
+    def _encode_text(self, text: str, invalid_code: int):
+        # INVALID_CHAR is codepoint 0
+        return [ord(char) or invalid_code for char in text]
+
+    def _counts_radix(self):
+        return 1 << self.CODEPOINT_BITS
+
+    def shares_encoding(self, other: NgramModel):
+        return isinstance(other, SparseNgramModel)
+
+    def _insert_code(self, code: int):
+        self.counts[code] = self.counts.get(code, 0) + 1
+
+    def insert_codes(self, text: str, runs: List[Tuple[int, str]], codes: List[int]):
+        counts = self.counts
+        for code in codes:
+            counts[code] = counts.get(code, 0) + 1
+        self._count_rejected(text, runs, len(codes))
+        return len(codes)
+
+    def code_lookup(self, probabilities: SparseProbabilities):
+        return 1 << self.CODEPOINT_BITS, probabilities
+
+    def add_code_probs(self, score: float, codes: List[int], table: SparseProbabilities, missing: float):
+        # one lookup of every code rather than a search of each
+        codes = np.array(codes, dtype=np.int64)
+        known = codes >= 0
+        values = np.full(len(codes), missing, dtype=np.float64)
+        values[known] = table.lookup(codes[known])
+        for value in values.tolist():
+            score += value
+        return score
+
+    def get_prob(self, ngram: str, probabilities: SparseProbabilities):
+        return probabilities[self._code(ngram)]
+
+    def get_probs(self, alphabet: List[str], windows: np.ndarray, probabilities: SparseProbabilities,
+                  missing: float):
+        in_corpus = np.array([char in self.corpus for char in alphabet], dtype=bool)
+        codepoints = np.array([ord(char) for char in alphabet], dtype=np.int64)
+        codes = np.zeros(len(windows), dtype=np.int64)
+        for position in range(self.n):
+            codes = (codes << self.CODEPOINT_BITS) | codepoints[windows[:, position]]
+
+        values = probabilities.lookup(codes)
+        values[~in_corpus[windows].all(axis=1)] = missing
+        return values
+
+    def compute_probabilities(self, prob_value):
+        return SparseProbabilities(self, prob_value)
+
+    def _merge_counts(self, other: 'SparseNgramModel'):
+        if other._sorted is None and other._restored is None:
+            other_counts = other.counts.items()
+        else:
+            sorted_counts = other.sorted_counts()
+            other_counts = zip(sorted_counts.codes.tolist(), sorted_counts.occurence_array().tolist())
+        counts = self.counts
+        for code, occurence in other_counts:
+            counts[code] = counts.get(code, 0) + occurence
+
+    def _export_arrays(self, probabilities: SparseProbabilities):
+        codes, counts, values = probabilities.sorted_counts()
+        return {'codes': codes, 'counts': counts, 'probabilities': values,
+                'unseen_value': np.array([probabilities.unseen_value], dtype=np.float64)}
+
+    def _restore_arrays(self, corpus_chars: List[str], arrays: Dict[str, np.ndarray]):
+        self.corpus = {char: 0 for char in corpus_chars}
+        self.counts = {}
+        self._sorted = None
+        self._restored = (arrays['codes'], arrays['counts'])
+        return SortedSparseProbabilities(arrays['codes'], arrays['counts'], arrays['probabilities'],
+                                         float(arrays['unseen_value'][0]))
+
+
+def insert_text_orders(ngram_models: List[NgramModel], text: str) -> List[int]:
+    """
+    insert_text() of text into the models of n = 1 to len(ngram_models), mapping text through the
+    vocabulary once. When the models share their encoding, text is encoded once and the code of every
+    n-gram extends the code of the (n-1)-gram it starts with by its last character. Returns the amount of
+    n-grams inserted per model
+    """
+    first = ngram_models[0]
+    mapped = first.vocabulary_text(text)
+    runs = [(match.start(), match.group()) for match in VALID_RUN_PATTERN.finditer(mapped)]
+    for ngram_model in ngram_models:
+        ngram_model.add_run_chars(text, runs)
+
+    counts = []
+    if not all(first.shares_encoding(ngram_model) for ngram_model in ngram_models[1:]):
+        for ngram_model in ngram_models:
+            radix = ngram_model._counts_radix()
+            counts.append(ngram_model.insert_codes(text, runs, [code for _, run in runs
+                                                                for code in ngram_model.iter_codes(run, radix)]))
+        return counts
+
+    radix = first._counts_radix()
+    # above every code of len(ngram_models) characters, the codes of n-grams holding it are too
+    invalid_code = radix ** len(ngram_models)
+    chars = first._encode_text(mapped, invalid_code)
+    codes = chars
+    for n, ngram_model in enumerate(ngram_models, 1):
+        if n > 1:
+            codes = [code * radix + char for code, char in zip(codes, chars[n - 1:])]
+        limit = radix ** n
+        counts.append(ngram_model.insert_codes(text, runs, [code for code in codes if code < limit]))
+    return counts
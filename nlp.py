@@ -1,64 +1,332 @@
 import argparse
-from parser import NgramTrainingDataParser, NgramTestParser, TFIDFWithStopWordTrainingParser, StopWordTestParser
+from parser import NgramTrainingDataParser, NgramTestParser, TFIDFWithStopWordTrainingParser, StopWordTestParser, \
+    MultiOrderNgramTrainingDataParser, InterpolatedTestParser, NGRAM_STORAGES
+from nlp_tools.tokenizers import TOKENIZERS
+from metrics import METRICS, instrumented
+from server import MAX_BATCH_SIZE, MAX_WAIT, serve
+from records import STDIN_PATH
+from sweep import parse_values, sweep
+from writers import TRACE_WRITERS
+
+import sys
+
+# arguments choosing the model, shared by test runs and serve
+model_arguments = argparse.ArgumentParser(add_help=False)
+model_arguments.add_argument('v',
+                             help="""Vocabulary to use
+                             0:[a-z],
+                             1:[a-z, A-Z],
+                             2:[a-z, A-Z] + all characters accepted by built-in isalpha(),
+                             -1: BYOM
+                             """,
+                             type=int)
+model_arguments.add_argument('n',
+                             help="""Size of n-grams
+                             1:character unigram (bag of words),
+                             2:character bigrams,
+                             3:character trigrams,
+                             -1: BYOM
+                             """,
+                             type=int)
+model_arguments.add_argument('delta',
+                             help='Smoothing value δ used for additive smoothing, -1: BYOM',
+                             type=float)
+model_arguments.add_argument('training_file',
+                             help='Path to training file for the language models, '
+                                  'may be compressed (.gz, .bz2, .xz), - for stdin',
+                             type=str)
+model_arguments.add_argument('--storage',
+                             help="""Storage of the n-gram counts
+                             dense: array of every possible n-gram,
+                             sparse: only the n-grams seen in training,
+                             auto: sparse for vocabulary 2, dense otherwise
+                             """,
+                             choices=NGRAM_STORAGES,
+                             default='auto')
+model_arguments.add_argument('--tokenizer',
+                             help="""Tokenizer of the BYOM tf-idf model
+                             nltk: NLTK word_tokenize,
+                             fast: regular expression splitting words
+                             """,
+                             choices=list(TOKENIZERS),
+                             default='nltk')
+model_arguments.add_argument('--rejections-top-k',
+                             help='Number of most dismissed n-grams to list per language after training',
+                             type=int,
+                             default=0)
+model_arguments.add_argument('--workers',
+                             help='Number of processes training on parts of the training file, '
+                                  'then scoring the test file',
+                             type=int,
+                             default=1)
+model_arguments.add_argument('--model',
+                             help='Path to a model file written by --save-model, skips training',
+                             type=str)
+model_arguments.add_argument('--save-model',
+                             help='Path to write the trained model file to',
+                             type=str)
+
+# arguments of the trace files, shared by test runs and sweep
+trace_arguments = argparse.ArgumentParser(add_help=False)
+trace_arguments.add_argument('--trace-format',
+                             help="""Format of the trace file
+                             text: tab separated lines followed by the accuracy,
+                             jsonl: one JSON object per tweet,
+                             csv: comma separated values with a header line
+                             """,
+                             choices=list(TRACE_WRITERS),
+                             default='text')
+trace_arguments.add_argument('--gzip-trace',
+                             help='Compresses the trace file with gzip, adding .gz to its name',
+                             action='store_true')
+
+# arguments of the metrics report and profile, shared by every mode
+instrumentation_arguments = argparse.ArgumentParser(add_help=False)
+instrumentation_arguments.add_argument('--metrics-out',
+                                       help='Path to write a JSON report to: wall and CPU time of each stage, '
+                                            'counters, throughput and peak RSS',
+                                       type=str)
+instrumentation_arguments.add_argument('--profile',
+                                       help='Path to write a cProfile dump of the run to, '
+                                            'readable with python -m pstats',
+                                       type=str)
 
 parser = argparse.ArgumentParser(
     description='Naive Bayes Classifier for Tweet Language Detection',
+    parents=[model_arguments, trace_arguments, instrumentation_arguments],
     formatter_class=argparse.ArgumentDefaultsHelpFormatter)
-parser.add_argument('v',
-                    help="""Vocabulary to use
-                    0:[a-z],
-                    1:[a-z, A-Z],
-                    2:[a-z, A-Z] + all characters accepted by built-in isalpha(),
-                    -1: BYOM
-                    """,
-                    type=int)
-parser.add_argument('n',
-                    help="""Size of n-grams
-                    1:character unigram (bag of words),
-                    2:character bigrams,
-                    3:character trigrams,
-                    -1: BYOM
-                    """,
-                    type=int)
-parser.add_argument('delta',
-                    help='Smoothing value δ used for additive smoothing, -1: BYOM',
-                    type=float)
-parser.add_argument('training_file',
-                    help='Path to training file for the language models',
-                    type=str)
 parser.add_argument('testing_file',
-                    help='Path to testing file for the language models',
+                    help='Path to testing file for the language models, '
+                         'may be compressed (.gz, .bz2, .xz), - for stdin except with --all-orders',
                     type=str)
+parser.add_argument('--all-orders',
+                    help='Trains the n-grams of every size from 1 to n in one pass over the training file, '
+                         'then tests each size',
+                    action='store_true')
+parser.add_argument('--interpolate',
+                    help='Comma separated weights of the n-gram sizes 1 to n. With --all-orders, also tests the '
+                         'sum of the scores of every size times its weight, into trace_<v>_1-<n>_<delta>.txt',
+                    type=str)
+parser.add_argument('--early-exit-margin',
+                    help='Approximate scoring of n-gram models: after the first n-grams of a tweet, stops scoring '
+                         'the languages behind the best one by this many log10 units. Their guesses may differ '
+                         'from a full scoring',
+                    type=float)
 
+serve_parser = argparse.ArgumentParser(
+    prog='nlp.py serve',
+    description='Loads or trains a model once, then classifies tweets sent as JSON lines '
+                '{"id": ..., "tweet": "..."} over TCP or a Unix socket',
+    parents=[model_arguments, instrumentation_arguments],
+    formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+serve_parser.add_argument('--host',
+                          help='Host to listen on',
+                          type=str,
+                          default='127.0.0.1')
+serve_parser.add_argument('--port',
+                          help='TCP port to listen on',
+                          type=int,
+                          default=8472)
+serve_parser.add_argument('--unix',
+                          help='Path of a Unix socket to listen on instead of TCP',
+                          type=str)
+serve_parser.add_argument('--max-batch-size',
+                          help='Most tweets scored together',
+                          type=int,
+                          default=MAX_BATCH_SIZE)
+serve_parser.add_argument('--max-wait-ms',
+                          help='Longest time a tweet waits for others to fill its batch',
+                          type=float,
+                          default=MAX_WAIT * 1000)
 
-def main():
-    args = parser.parse_args()
+sweep_parser = argparse.ArgumentParser(
+    prog='nlp.py sweep',
+    description='Tests every (v, n, delta) combination of the given values, training the counts of each (v, n) '
+                'once. Values are comma separated, with inclusive start:stop:step ranges, e.g. 0.1:1:0.1',
+    parents=[trace_arguments, instrumentation_arguments],
+    formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+sweep_parser.add_argument('training_file',
+                          help='Path to training file for the language models, '
+                               'may be compressed (.gz, .bz2, .xz), - for stdin with a single --v',
+                          type=str)
+sweep_parser.add_argument('testing_file',
+                          help='Path to testing file for the language models, '
+                               'may be compressed (.gz, .bz2, .xz), - for stdin with a single configuration',
+                          type=str)
+sweep_parser.add_argument('--v',
+                          help='Vocabularies to use',
+                          type=str,
+                          default='0,1,2')
+sweep_parser.add_argument('--n',
+                          help='Sizes of n-grams',
+                          type=str,
+                          default='1,2,3')
+sweep_parser.add_argument('--delta',
+                          help='Smoothing values',
+                          type=str,
+                          default='0.1:1:0.1')
+sweep_parser.add_argument('--storage',
+                          help='Storage of the n-gram counts, see nlp.py --help',
+                          choices=NGRAM_STORAGES,
+                          default='auto')
+sweep_parser.add_argument('--workers',
+                          help='Number of processes training, then testing configurations in parallel',
+                          type=int,
+                          default=1)
 
+
+def trained_parser(args, argument_parser: argparse.ArgumentParser):
+    """
+    Loads the model file given by --model, or trains the model chosen by v, n and delta
+    """
     if args.v == -1 and args.n == -1 and args.delta == -1:
-        tf_idf_stop_word_model_training_parser: TFIDFWithStopWordTrainingParser = TFIDFWithStopWordTrainingParser(
-            args.training_file
-        )
-        tf_idf_stop_word_model_training_parser.parse()
+        if args.model:
+            with METRICS.stage('model/load'):
+                tf_idf_stop_word_model_training_parser: TFIDFWithStopWordTrainingParser = \
+                    TFIDFWithStopWordTrainingParser.load(args.model)
+        else:
+            tf_idf_stop_word_model_training_parser: TFIDFWithStopWordTrainingParser = TFIDFWithStopWordTrainingParser(
+                args.training_file,
+                args.tokenizer
+            )
+            tf_idf_stop_word_model_training_parser.parse(args.workers)
+        if args.save_model:
+            with METRICS.stage('model/save'):
+                tf_idf_stop_word_model_training_parser.save(args.save_model)
+        return tf_idf_stop_word_model_training_parser
 
-        stop_word_test_parser: StopWordTestParser = StopWordTestParser(
-            tf_idf_stop_word_model_training_parser,
-            args.testing_file
-        )
-        stop_word_test_parser.parse()
+    if args.model:
+        with METRICS.stage('model/load'):
+            training_data_parser: NgramTrainingDataParser = NgramTrainingDataParser.load(args.model)
+        if (training_data_parser.vocabulary, training_data_parser.ngram_size, training_data_parser.smoothing) \
+                != (args.v, args.n, args.delta):
+            argument_parser.error('{} was trained with v={} n={} delta={}'.format(
+                args.model,
+                training_data_parser.vocabulary,
+                training_data_parser.ngram_size,
+                training_data_parser.smoothing
+            ))
     else:
         training_data_parser: NgramTrainingDataParser = NgramTrainingDataParser(
             args.training_file,
             args.n,
             args.v,
-            args.delta
+            args.delta,
+            args.storage,
+            args.rejections_top_k
         )
-        training_data_parser.parse()
+        training_data_parser.parse(args.workers)
+    if args.save_model:
+        with METRICS.stage('model/save'):
+            training_data_parser.save(args.save_model)
+    return training_data_parser
+
+
+def run_all_orders(args):
+    """
+    Trains every n-gram size up to n at once, then writes the trace and eval files of each size, and of
+    their interpolation when weighted
+    """
+    if args.v == -1 or args.n < 1:
+        parser.error('--all-orders needs an n-gram model')
+    if args.model or args.save_model:
+        parser.error('--all-orders does not load nor save model files')
+    weights = None
+    if args.interpolate:
+        try:
+            weights = [float(weight) for weight in args.interpolate.split(',')]
+        except ValueError:
+            parser.error('--interpolate needs comma separated numbers')
+        if len(weights) != args.n:
+            parser.error('--interpolate needs {} weights, one per n-gram size'.format(args.n))
+    if args.testing_file == STDIN_PATH and (args.n > 1 or weights is not None):
+        # the testing file is read again for each size and the interpolation
+        parser.error('stdin can only be read once, give a testing file with --all-orders')
+
+    training_parser: MultiOrderNgramTrainingDataParser = MultiOrderNgramTrainingDataParser(
+        args.training_file,
+        args.n,
+        args.v,
+        args.delta,
+        args.storage,
+        args.rejections_top_k,
+        weights
+    )
+    training_parser.parse(args.workers)
+    for order_parser in training_parser.order_parsers:
+        order_parser.early_exit_margin = args.early_exit_margin
+        NgramTestParser(order_parser, args.testing_file, args.trace_format, args.gzip_trace).parse(args.workers)
+        # the interpolation needs the scores of every language
+        order_parser.early_exit_margin = None
+    if weights is not None:
+        InterpolatedTestParser(training_parser, args.testing_file, args.trace_format, args.gzip_trace) \
+            .parse(args.workers)
 
+
+def run_test(args):
+    """
+    Trains or loads the model, then writes the trace and eval files of the test file
+    """
+    if args.all_orders:
+        run_all_orders(args)
+        return
+    if args.interpolate:
+        parser.error('--interpolate needs --all-orders')
+
+    training_parser = trained_parser(args, parser)
+    if isinstance(training_parser, TFIDFWithStopWordTrainingParser):
+        stop_word_test_parser: StopWordTestParser = StopWordTestParser(
+            training_parser,
+            args.testing_file,
+            args.trace_format,
+            args.gzip_trace
+        )
+        stop_word_test_parser.parse(args.workers)
+    else:
+        training_parser.early_exit_margin = args.early_exit_margin
         test_parser: NgramTestParser = NgramTestParser(
-            training_data_parser,
-            args.testing_file
+            training_parser,
+            args.testing_file,
+            args.trace_format,
+            args.gzip_trace
         )
-        test_parser.parse()
+        test_parser.parse(args.workers)
+
+
+def main():
+    if sys.argv[1:2] == ['serve']:
+        args = serve_parser.parse_args(sys.argv[2:])
+        with instrumented(args.metrics_out, args.profile):
+            serve(trained_parser(args, serve_parser), args.host, args.port, args.unix, args.max_batch_size,
+                  args.max_wait_ms / 1000)
+        return
+    if sys.argv[1:2] == ['sweep']:
+        args = sweep_parser.parse_args(sys.argv[2:])
+        try:
+            vocabularies = parse_values(args.v, int)
+            ngram_sizes = parse_values(args.n, int)
+            smoothings = parse_values(args.delta)
+        except ValueError as e:
+            sweep_parser.error(str(e))
+        if args.training_file == STDIN_PATH and len(vocabularies) > 1:
+            # the training file is read again for each vocabulary
+            sweep_parser.error('stdin can only be read once, give a training file or a single --v')
+        if args.testing_file == STDIN_PATH and len(vocabularies) * len(ngram_sizes) * len(smoothings) > 1:
+            # the testing file is read again for each configuration
+            sweep_parser.error('stdin can only be read once, give a testing file or a single configuration')
+        with instrumented(args.metrics_out, args.profile):
+            sweep(vocabularies, ngram_sizes, smoothings, args.training_file, args.testing_file, args.storage,
+                  args.workers, args.trace_format, args.gzip_trace)
+        return
+
+    args = parser.parse_args()
+    if args.early_exit_margin is not None:
+        if args.v == -1:
+            parser.error('--early-exit-margin needs an n-gram model')
+        if args.early_exit_margin < 0:
+            parser.error('--early-exit-margin cannot be negative')
+    with instrumented(args.metrics_out, args.profile):
+        run_test(args)
 
 
 if __name__ == '__main__':
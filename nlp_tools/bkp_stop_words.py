@@ -1,21 +1,32 @@
 # Content extracted from https://github.com/Xangis/extra-stopwords
+from functools import lru_cache
+from typing import Set
 
-BKP_STOP_WORDS = {
-    'eu': set(),
-    'gl': set(),
-    'ca': set()
-}
+import os
 
-for bkp_lang in BKP_STOP_WORDS:
+BKP_STOP_WORDS_LANGUAGES = ['eu', 'gl', 'ca']
+BKP_STOP_WORDS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+@lru_cache(maxsize=None)
+def bkp_stop_words(language: str) -> Set[str]:
+    """
+    Reads the backup stop words of a language, the first column of the nlp_tools/<language> file
+    """
+    path = os.path.join(BKP_STOP_WORDS_DIR, language)
     try:
-        f = open('nlp_tools/{}'.format(bkp_lang), "r")
-    except FileNotFoundError as e:
-        print(e)
-        print("Please add corresponding backup stop word file")
-        exit(1)
+        f = open(path, "r")
+    except FileNotFoundError:
+        raise FileNotFoundError('{} is missing, please add corresponding backup stop word file'.format(path))
+
+    with f:
+        return {line.strip().split('\t')[0] for line in f}
+
 
-    lines = f.readlines()
-    bkp_lang_stop_words = set()
-    for line in lines:
-        bkp_lang_stop_words.add(line.strip().split('\t')[0])
-    BKP_STOP_WORDS[bkp_lang] = bkp_lang_stop_words
+def __getattr__(name):
+    """
+    Keeps BKP_STOP_WORDS importable without reading the files at import time
+    """
+    if name == 'BKP_STOP_WORDS':
+        return {language: bkp_stop_words(language) for language in BKP_STOP_WORDS_LANGUAGES}
+    raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
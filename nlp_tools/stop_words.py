@@ -0,0 +1,53 @@
+from nlp_tools.bkp_stop_words import bkp_stop_words
+from typing import Dict, Set
+
+import json
+import os
+
+# stop word sets built once from NLTK's corpus and the backup files, delete it to build them again
+STOP_WORDS_CACHE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'stop_words.cache.json')
+STOP_WORDS_CACHE_VERSION = 1
+
+
+def build_stop_words(languages: Dict[str, str]) -> Dict[str, Set[str]]:
+    """
+    Stop words of every language code of languages, from the NLTK stopwords corpus named by its value,
+    or else from the backup files
+    """
+    from nltk.corpus import stopwords
+
+    stop_words = {}
+    for language, nltk_language in languages.items():
+        try:
+            stop_words[language] = set(stopwords.words(nltk_language))
+        except IOError:
+            stop_words[language] = bkp_stop_words(language)
+    return stop_words
+
+
+def load_stop_words(languages: Dict[str, str]) -> Dict[str, Set[str]]:
+    """
+    build_stop_words(), read from STOP_WORDS_CACHE_PATH once it was written for the same languages
+    """
+    try:
+        with open(STOP_WORDS_CACHE_PATH, 'r') as f:
+            cache = json.load(f)
+        if cache.get('version') == STOP_WORDS_CACHE_VERSION and cache.get('languages') == languages:
+            return {language: set(words) for language, words in cache['stop_words'].items()}
+    except (OSError, ValueError):
+        pass
+
+    stop_words = build_stop_words(languages)
+    cache = {
+        'version': STOP_WORDS_CACHE_VERSION,
+        'languages': languages,
+        'stop_words': {language: sorted(words) for language, words in stop_words.items()}
+    }
+    try:
+        with open(STOP_WORDS_CACHE_PATH + '.tmp', 'w') as f:
+            json.dump(cache, f, ensure_ascii=False)
+        os.replace(STOP_WORDS_CACHE_PATH + '.tmp', STOP_WORDS_CACHE_PATH)
+    except OSError:
+        # read-only install, built again next time
+        pass
+    return stop_words
@@ -0,0 +1,28 @@
+from typing import List
+
+import re
+
+# Unicode-aware: \w matches letters and digits of every script. Punctuation is dropped, the tf-idf
+# model only keeps alphanumerical words of more than one character anyway
+FAST_TOKEN_PATTERN = re.compile(r'\w+')
+
+
+def nltk_tokenize(text: str) -> List[str]:
+    """
+    NLTK's Treebank-based tokenizer, needs the punkt data. NLTK is only imported once used
+    """
+    from nltk.tokenize import word_tokenize
+    return word_tokenize(text)
+
+
+def fast_tokenize(text: str) -> List[str]:
+    """
+    Splits text into runs of word characters
+    """
+    return FAST_TOKEN_PATTERN.findall(text)
+
+
+TOKENIZERS = {
+    'nltk': nltk_tokenize,
+    'fast': fast_tokenize
+}
@@ -1,27 +1,88 @@
 from abc import ABC, abstractmethod
 from language import LANGUAGES, LANGUAGE_DICT
-from ngrams import UnigramModel, BigramModel, TrigramModel
-from training import NgramTrainingModel, TFIDFWithStopWordTrainingModel, Score, ClassScore
-from typing import List, Dict, Any
-
-from nltk.corpus import stopwords
-from nltk.tokenize import word_tokenize
-from nlp_tools.bkp_stop_words import BKP_STOP_WORDS
-
+from ngrams import NgramModel, DenseNgramModel, UnigramModel, BigramModel, TrigramModel, SparseNgramModel
+from training import NgramTrainingModel, TFIDFWithStopWordTrainingModel, Results, ClassScore, normalized_tokens
+from persistence import read_model_file, write_model_file
+from writers import TRACE_WRITERS, TraceWriter, trace_path
+from metrics import METRICS
+from records import ProgressReporter, TweetRecord, byte_ranges, is_plain_file, iter_records, open_lines, \
+    read_byte_range
+from typing import List, Dict, Any, Iterable, Iterator, Set, Tuple
+
+from nlp_tools.tokenizers import TOKENIZERS
+from nlp_tools.stop_words import load_stop_words
+from collections import Counter, OrderedDict, deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from functools import lru_cache
+
+import copy
+import multiprocessing
+import numpy as np
 import os
 
 REL_PATH_TO_TRACE = "./output/trace_{}_{}_{}.txt"
 REL_PATH_TO_EVAL = "./output/eval_{}_{}_{}.txt"
+REL_PATH_TO_TRACE_INTERPOLATED = "./output/trace_{}_1-{}_{}.txt"
+REL_PATH_TO_EVAL_INTERPOLATED = "./output/eval_{}_1-{}_{}.txt"
 REL_PATH_TO_TRACE_BYOM = "./output/trace_my_model.txt"
 REL_PATH_TO_EVAL_BYOM = "./output/eval_my_model.txt"
 
-language_stopwords = {}
+TEST_BATCH_SIZE = 1024
+TFIDF_SCORE_CACHE_SIZE = 1 << 16  # scores kept for duplicate tweets and retweets
+# tweets with fewer n-grams are summed in one zero-padded array, longer ones grouped by power of two, see
+# _sequential_sums()
+PADDED_WIDTH = 256
+EARLY_EXIT_PREFIX = 32  # n-grams of every tweet scored for every language before pruning, see score_batch()
+
+# auto: dense counts for vocab 0 and 1, sparse counts for vocab 2
+NGRAM_STORAGES = ['auto', 'dense', 'sparse']
+
+
+@lru_cache(maxsize=None)
+def load_language_stopwords() -> Dict[str, Set[str]]:
+    """
+    Stop words of every language, loaded on first use by the tf-idf models only
+    """
+    return load_stop_words({language: LANGUAGE_DICT[language] for language in LANGUAGES})
+
+
+def __getattr__(name):
+    """
+    Keeps language_stopwords importable without loading the stop words at import time
+    """
+    if name == 'language_stopwords':
+        return load_language_stopwords()
+    raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
+
 
-for lang in LANGUAGES:
-    try:
-        language_stopwords[lang] = set(stopwords.words(LANGUAGE_DICT[lang]))
-    except IOError as e:
-        language_stopwords[lang] = BKP_STOP_WORDS[lang]
+def _sequential_sums(initial: np.ndarray, rows: np.ndarray, columns: np.ndarray, values: np.ndarray,
+                     lengths: np.ndarray) -> np.ndarray:
+    """
+    initial[row] followed by the values of the row in column order, added one after the other like
+    NgramTrainingModel.test() does. lengths holds the number of values of every row.
+    Rows are padded with zeros to the longest row of their group, rows shorter than PADDED_WIDTH being one group
+    and longer ones grouped by power of two, so that a long tweet does not pad every other row to its length
+    """
+    sums = np.array(initial, dtype=np.float64)
+    if lengths.max(initial=0) < PADDED_WIDTH:
+        groups = [(slice(None), rows, columns, values)]
+    else:
+        # rows of each group, and the row within the group, column and value of its values
+        groups = []
+        row_groups = np.frexp(np.maximum(lengths, PADDED_WIDTH - 1))[1]
+        slots = np.zeros(len(lengths), dtype=np.int64)
+        for group in np.unique(row_groups[lengths > 0]):
+            group_rows = np.flatnonzero((row_groups == group) & (lengths > 0))
+            slots[group_rows] = np.arange(len(group_rows))
+            selected = row_groups[rows] == group
+            groups.append((group_rows, slots[rows[selected]], columns[selected], values[selected]))
+
+    for group_rows, group_slots, group_columns, group_values in groups:
+        terms = np.zeros((len(sums[group_rows]), lengths[group_rows].max() + 1), dtype=np.float64)
+        terms[:, 0] = sums[group_rows]
+        terms[group_slots, group_columns + 1] = group_values
+        sums[group_rows] = np.cumsum(terms, axis=1, out=terms)[:, -1]
+    return sums
 
 
 class TrainingParser(ABC):
@@ -30,7 +91,9 @@ class TrainingParser(ABC):
     """
     def __init__(self, input_file):
         self.models: Dict[str, Any] = {}
-        self.input_file: str = input_file
+        self.input_file = input_file  # path, '-' for stdin, or iterable of lines or records
+        self.document_count = 0  # documents the models were trained on
+        self.scoring_stats = Counter()  # kept by scorers skipping part of the work, see take_scoring_stats()
 
     @abstractmethod
     def _insert(self, parsed_lang: str, parsed_tweet_content: str):
@@ -46,131 +109,599 @@ class TrainingParser(ABC):
         """
         pass
 
-    def parse(self):
+    @abstractmethod
+    def _post_update(self, updated_languages: Set[str]):
         """
-        Parses the training data
+        Defines what update() recomputes once the new records are inserted
+        """
+        pass
+
+    def score_batch(self, tweets: List[str]) -> np.ndarray:
+        """
+        Scores every tweet against every language, returns an array of shape [len(tweets), len(LANGUAGES)]
+        """
+        scores = np.zeros((len(tweets), len(LANGUAGES)), dtype=np.float64)
+        for row, tweet in enumerate(tweets):
+            for column, language in enumerate(LANGUAGES):
+                scores[row, column] = self.models[language].test(tweet)
+        return scores
+
+    def take_scoring_stats(self) -> Counter:
+        """
+        Returns the scoring stats and starts new ones
+        """
+        scoring_stats = self.scoring_stats
+        self.scoring_stats = Counter()
+        return scoring_stats
+
+    @abstractmethod
+    def _merge_models(self, models: Dict[str, Any]):
+        """
+        Adds models trained on another part of the training data to the ones of this parser
+        """
+        pass
+
+    def _parse_records(self, lines, stage: str) -> int:
+        """
+        Inserts every record, returns the number of documents
         """
         document_count = 0
+        progress = ProgressReporter(stage)
+        record: TweetRecord
+        for record in progress.track(iter_records(lines)):
+            document_count += 1
+            self._insert(record.language, record.content)
+        progress.done()
+        return document_count
+
+    def _parse_shard(self, shard: int, start: int, end: int):
+        """
+        Runs in a worker process on an untrained copy of the parser
+        """
+        document_count = self._parse_records(read_byte_range(self.input_file, start, end),
+                                             'training shard {}'.format(shard))
+        return self.models, document_count, METRICS.take_counters()
+
+    def parse(self, workers: int = 1):
+        """
+        Parses the training data
+        With several workers, a plain training file is split into byte ranges trained in parallel,
+        whose models are then merged. Other inputs are read sequentially
+        """
+        with METRICS.stage('training'):
+            self._parse(workers)
+
+    def _parse(self, workers: int):
         try:
-            f = open(self.input_file, "r")
+            source = open_lines(self.input_file)
         except FileNotFoundError as e:
             print(e)
             print("Please input a file that exists.")
             exit(1)
 
-        lines: List[str] = f.readlines()
-        for line in lines:
+        if workers > 1 and is_plain_file(self.input_file):
+            source.close()
+            document_count = 0
+            with METRICS.stage('training/insert'), ProcessPoolExecutor(workers) as executor:
+                shards = [executor.submit(self._parse_shard, shard, start, end)
+                          for shard, (start, end) in enumerate(byte_ranges(self.input_file, workers))]
+                for shard in shards:
+                    shard_models, shard_document_count, shard_counters = shard.result()
+                    self._merge_models(shard_models)
+                    METRICS.add_counters(shard_counters)
+                    document_count += shard_document_count
+        else:
+            with METRICS.stage('training/insert'), source as lines:
+                document_count = self._parse_records(lines, 'training')
+
+        self.document_count = document_count
+        METRICS.count('tweets_ingested', document_count)
+        with METRICS.stage('training/post_parse'):
+            self._post_parse(document_count)
+
+    def update(self, records: Iterable) -> int:
+        """
+        Folds new labelled records, lines or (tweet_id, username, language, content) tuples, into the trained
+        models. Only what the new records change is recomputed. Returns the number of documents added
+        """
+        document_count = 0
+        updated_languages = set()
+        record: TweetRecord
+        for record in iter_records(records):
             document_count += 1
-            line_info: List[str] = line.split('\t')
-            parsed_tweet_id = line_info[0]
-            parsed_username = line_info[1]
-            parsed_language = line_info[2]
-            parsed_tweet_content = line_info[3]
-            self._insert(parsed_language, parsed_tweet_content)
+            updated_languages.add(record.language)
+            self._insert(record.language, record.content)
 
-        self._post_parse(document_count)
+        self.document_count += document_count
+        METRICS.count('tweets_ingested', document_count)
+        with METRICS.stage('update/post_update'):
+            self._post_update(updated_languages)
+        return document_count
 
 
 class NgramTrainingDataParser(TrainingParser):
     """
     n-gram-specific training data parsing
     """
-    def __init__(self, input_file: str, ngram_size: int, vocabulary: int, smoothing: float):
+    def __init__(self, input_file: str, ngram_size: int, vocabulary: int, smoothing: float, storage: str = 'auto',
+                 rejections_top_k: int = 0):
         super(NgramTrainingDataParser, self).__init__(input_file)
         self.input_file: str = input_file
         self.ngram_size: int = ngram_size
         self.vocabulary: int = vocabulary
         self.smoothing: float = smoothing
+        self.storage: str = storage
+        self.rejections_top_k: int = rejections_top_k  # most dismissed n-grams listed after training
+        # log10 score deficit dropping a language after the first n-grams of a tweet, see score_batch()
+        self.early_exit_margin: float = None
         self.models: Dict[str: NgramTrainingModel] = {}
 
         for lang_ in LANGUAGES:
-            if ngram_size == 1:
-                self.models[lang_] = NgramTrainingModel(lang_, UnigramModel(vocabulary))
-            elif ngram_size == 2:
-                self.models[lang_] = NgramTrainingModel(lang_, BigramModel(vocabulary))
-            elif ngram_size == 3:
-                self.models[lang_] = NgramTrainingModel(lang_, TrigramModel(vocabulary))
+            self.models[lang_] = NgramTrainingModel(lang_, self._build_ngram_model())
+            if rejections_top_k > 0:
+                self.models[lang_].ngram_model.rejected_ngrams = Counter()
+
+    def _build_ngram_model(self) -> NgramModel:
+        """
+        Creates the empty n-gram model of a class for the chosen storage
+        """
+        if self.storage == 'sparse' or (self.storage == 'auto' and self.vocabulary == 2):
+            return SparseNgramModel(self.vocabulary, self.ngram_size)
+        elif self.ngram_size == 1:
+            return UnigramModel(self.vocabulary)
+        elif self.ngram_size == 2:
+            return BigramModel(self.vocabulary)
+        elif self.ngram_size == 3:
+            return TrigramModel(self.vocabulary)
 
     def _insert(self, parsed_lang: str, parsed_tweet_content: str):
         self.models[parsed_lang].insert(parsed_tweet_content)
 
+    def _merge_models(self, models: Dict[str, NgramTrainingModel]):
+        for model_lang in self.models:
+            self.models[model_lang].merge(models[model_lang])
+
     def _naive_bayes(self):
-        for model_lang in self.models:  # for each class
-            self.models[model_lang].compute()
+        with METRICS.stage('training/compute'):
+            for model_lang in self.models:  # for each class
+                self.models[model_lang].compute()
+
+    def _report_rejections(self):
+        """
+        Summary of the n-grams dismissed because of the vocabulary, per class
+        """
+        print('Dismissed for vocab {}: {}'.format(
+            self.vocabulary, sum(self.models[model_lang].ngram_model.rejected for model_lang in self.models)))
+        for model_lang in self.models:
+            ngram_model: NgramModel = self.models[model_lang].ngram_model
+            print('\t{}: {}'.format(model_lang, ngram_model.rejected))
+            if ngram_model.rejected_ngrams is not None:
+                for ngram, count in ngram_model.rejected_ngrams.most_common(self.rejections_top_k):
+                    print('\t\t"{}": {}'.format(ngram, count))
 
     def _post_parse(self, document_count: int):
+        self._report_rejections()
+        METRICS.count('ngrams_inserted', sum(self.models[model_lang].class_size for model_lang in self.models))
+        METRICS.count('ngrams_rejected', sum(self.models[model_lang].ngram_model.rejected
+                                             for model_lang in self.models))
         for model_lang in self.models:
             self.models[model_lang].post_parse(document_count, self.smoothing)
         self._naive_bayes()
 
+    def with_smoothings(self, smoothings: List[float]) -> List['NgramTrainingDataParser']:
+        """
+        Trained parsers for other smoothing values, sharing the counts of this one since they don't depend
+        on the smoothing. The probabilities of every smoothing value are derived together
+        """
+        training_parsers = []
+        for smoothing in smoothings:
+            training_parser = copy.copy(self)
+            training_parser.smoothing = smoothing
+            training_parser.scoring_stats = Counter()
+            training_parser.models = {}
+            for model_lang in self.models:
+                model = NgramTrainingModel(model_lang, self.models[model_lang].ngram_model)
+                model.docs_for_this_model = self.models[model_lang].docs_for_this_model
+                model.class_size = self.models[model_lang].class_size
+                model.post_parse(self.document_count, smoothing)
+                training_parser.models[model_lang] = model
+            training_parsers.append(training_parser)
+
+        for model_lang in self.models:
+            models = [training_parser.models[model_lang] for training_parser in training_parsers]
+            probabilities = self.models[model_lang].ngram_model.compute_probabilities_many(
+                [model._compute_prob_value for model in models])
+            for model, model_probabilities in zip(models, probabilities):
+                model.probabilities = model_probabilities
+        return training_parsers
+
+    def _post_update(self, updated_languages: Set[str]):
+        """
+        Priors depend on the total number of documents. The probabilities of a language only depend on its own
+        counts, they are recomputed for the languages of the new records
+        """
+        for model_lang in self.models:
+            self.models[model_lang].post_parse(self.document_count, self.smoothing)
+        for model_lang in updated_languages:
+            self.models[model_lang].compute()
+
+    def score_batch(self, tweets: List[str]) -> np.ndarray:
+        """
+        Encodes the n-grams of every tweet once, then gathers their log-probabilities for each language
+        with array operations. Scores are summed in the same order as NgramTrainingModel.test() so that
+        both give the exact same values.
+        With early_exit_margin, languages dropped before the end of a tweet score -inf, see
+        _score_batch_early_exit()
+        """
+        scores = np.zeros((len(tweets), len(LANGUAGES)), dtype=np.float64)
+        if len(tweets) == 0:
+            return scores
+        alphabet_chars, windows_per_tweet, rows, columns, windows = self._windows(tweets)
+        METRICS.count('ngrams_scored', int(windows_per_tweet.sum()))
+        if self.early_exit_margin is not None:
+            return self._score_batch_early_exit(alphabet_chars, windows_per_tweet, rows, columns, windows)
+
+        for column, language in enumerate(LANGUAGES):
+            model: NgramTrainingModel = self.models[language]
+            values = model.ngram_model.get_probs(alphabet_chars, windows, model.probabilities,
+                                                 model.non_existing_char_prob)
+            scores[:, column] = _sequential_sums(np.full(len(tweets), model.prior), rows, columns, values,
+                                                 windows_per_tweet)
+        return scores
+
+    def _windows(self, tweets: List[str]):
+        """
+        N-grams of a non-empty batch of tweets as an array of shape [count, n] of indices into the alphabet of
+        the batch, in tweet order. Returns the alphabet, the number of n-grams of every tweet, and the tweet
+        and position within it of every n-gram
+        """
+        n = self.ngram_size
+        windows_per_tweet = np.array([max(len(tweet) - n + 1, 0) for tweet in tweets], dtype=np.int64)
+        codepoints = np.frombuffer(''.join(tweets).encode('utf-32-le', 'surrogatepass'), dtype=np.uint32)
+        alphabet, encoded = np.unique(codepoints, return_inverse=True)
+        alphabet_chars = [chr(codepoint) for codepoint in alphabet]
+
+        # position of every n-gram within its tweet, and of its first character within the joined tweets
+        tweet_starts = np.cumsum([0] + [len(tweet) for tweet in tweets[:-1]])
+        first_windows = np.cumsum(windows_per_tweet) - windows_per_tweet
+        rows = np.repeat(np.arange(len(tweets)), windows_per_tweet)
+        columns = np.arange(windows_per_tweet.sum()) - np.repeat(first_windows, windows_per_tweet)
+        starts = np.repeat(tweet_starts, windows_per_tweet) + columns
+        windows = encoded.reshape(-1)[starts[:, np.newaxis] + np.arange(n)]
+        return alphabet_chars, windows_per_tweet, rows, columns, windows
+
+    def _score_batch_early_exit(self, alphabet_chars: List[str], windows_per_tweet: np.ndarray, rows: np.ndarray,
+                                columns: np.ndarray, windows: np.ndarray) -> np.ndarray:
+        """
+        Approximate scoring of the n-grams of _windows(): every language scores the first EARLY_EXIT_PREFIX
+        n-grams of a tweet, then only the languages within early_exit_margin of the best partial score go on
+        with the rest of it. Those get their exact score and the dropped ones -inf, so a guess differs from
+        score_batch() when a dropped language would have caught up
+        """
+        models: List[NgramTrainingModel] = [self.models[language] for language in LANGUAGES]
+        scores = np.zeros((len(windows_per_tweet), len(LANGUAGES)), dtype=np.float64)
+        head = columns < EARLY_EXIT_PREFIX
+        head_rows, head_columns, head_windows = rows[head], columns[head], windows[head]
+        for column, model in enumerate(models):
+            values = model.ngram_model.get_probs(alphabet_chars, head_windows, model.probabilities,
+                                                 model.non_existing_char_prob)
+            scores[:, column] = _sequential_sums(np.full(len(scores), model.prior), head_rows, head_columns, values,
+                                                 np.minimum(windows_per_tweet, EARLY_EXIT_PREFIX))
+        active = scores >= scores.max(axis=1)[:, np.newaxis] - self.early_exit_margin
+        lookups = len(head_windows) * len(LANGUAGES)
+
+        # the partial score followed by the remaining n-grams, for the tweets and languages still scored
+        tail_rows, tail_columns, tail_windows = rows[~head], columns[~head] - EARLY_EXIT_PREFIX, windows[~head]
+        tail_lengths = np.maximum(windows_per_tweet - EARLY_EXIT_PREFIX, 0)
+        for column, model in enumerate(models):
+            if not (active[:, column] & (tail_lengths > 0)).any():
+                continue
+            scored = active[tail_rows, column]
+            values = model.ngram_model.get_probs(alphabet_chars, tail_windows[scored], model.probabilities,
+                                                 model.non_existing_char_prob)
+            scores[:, column] = _sequential_sums(scores[:, column], tail_rows[scored], tail_columns[scored], values,
+                                                 np.where(active[:, column], tail_lengths, 0))
+            lookups += len(values)
+
+        METRICS.count('ngram_lookups', lookups)
+        self.scoring_stats.update({'tweets': len(scores), 'ngrams': len(windows), 'lookups': lookups})
+        return np.where(active, scores, -np.inf)
+
+    def save(self, path: str):
+        """
+        Writes the trained models to a model file, see persistence.py
+        """
+        header = {
+            'kind': 'ngram',
+            'vocab': self.vocabulary,
+            'n': self.ngram_size,
+            'delta': self.smoothing,
+            'storage': 'dense' if isinstance(self.models[LANGUAGES[0]].ngram_model, DenseNgramModel) else 'sparse',
+            'languages': LANGUAGES,
+            'models': {}
+        }
+        arrays = {}
+        for language in LANGUAGES:
+            model: NgramTrainingModel = self.models[language]
+            meta, model_arrays = model.ngram_model.export(model.probabilities)
+            header['models'][language] = dict(model.state(), **meta)
+            for name, array in model_arrays.items():
+                arrays['{}/{}'.format(language, name)] = array
+        write_model_file(path, header, arrays)
+
+    @classmethod
+    def load(cls, path: str):
+        """
+        Loads models written by save(), their arrays are memory-mapped from the file
+        """
+        header, arrays = read_model_file(path, 'ngram')
+        if header['languages'] != LANGUAGES:
+            raise ValueError('{} was trained for languages {}'.format(path, header['languages']))
+
+        training_parser = cls(path, header['n'], header['vocab'], header['delta'], header['storage'])
+        for language in LANGUAGES:
+            model: NgramTrainingModel = training_parser.models[language]
+            meta = header['models'][language]
+            model.probabilities = model.ngram_model.restore(meta, {
+                name.split('/', 1)[1]: array for name, array in arrays.items() if name.startswith(language + '/')
+            })
+            model.load_state({attribute: meta[attribute] for attribute in model.state()})
+        training_parser.document_count = training_parser.models[LANGUAGES[0]].total_doc_count
+        return training_parser
+
+
+class MultiOrderNgramTrainingDataParser(TrainingParser):
+    """
+    Trains the n-gram models of every size from 1 to max_ngram_size in a single pass over the training data.
+    Each size is a standard NgramTrainingDataParser, see order_parser(), and score_batch() interpolates them
+    """
+    def __init__(self, input_file: str, max_ngram_size: int, vocabulary: int, smoothing: float,
+                 storage: str = 'auto', rejections_top_k: int = 0, weights: List[float] = None):
+        super(MultiOrderNgramTrainingDataParser, self).__init__(input_file)
+        self.max_ngram_size: int = max_ngram_size
+        self.vocabulary: int = vocabulary
+        self.smoothing: float = smoothing
+        self.order_parsers: List[NgramTrainingDataParser] = [
+            NgramTrainingDataParser(input_file, ngram_size, vocabulary, smoothing, storage, rejections_top_k)
+            for ngram_size in range(1, max_ngram_size + 1)
+        ]
+        # weight of the scores of each size in score_batch(), uniform by default
+        self.weights: List[float] = weights if weights is not None else [1 / max_ngram_size] * max_ngram_size
+        if len(self.weights) != max_ngram_size:
+            raise ValueError('{} weights given for n-gram sizes 1 to {}'.format(len(self.weights), max_ngram_size))
+        # models of every size per language, shared with the order parsers
+        self.models: Dict[str, List[NgramTrainingModel]] = {
+            language: [order_parser.models[language] for order_parser in self.order_parsers] for language in LANGUAGES
+        }
+
+    def order_parser(self, ngram_size: int) -> NgramTrainingDataParser:
+        """
+        Trained parser of one n-gram size
+        """
+        return self.order_parsers[ngram_size - 1]
+
+    def _insert(self, parsed_lang: str, parsed_tweet_content: str):
+        NgramTrainingModel.insert_orders(self.models[parsed_lang], parsed_tweet_content)
+
+    def _merge_models(self, models: Dict[str, List[NgramTrainingModel]]):
+        for order, order_parser in enumerate(self.order_parsers):
+            order_parser._merge_models({language: models[language][order] for language in models})
+
+    def _post_parse(self, document_count: int):
+        for order_parser in self.order_parsers:
+            print('n={}'.format(order_parser.ngram_size))
+            order_parser.document_count = document_count
+            order_parser._post_parse(document_count)
+
+    def _post_update(self, updated_languages: Set[str]):
+        for order_parser in self.order_parsers:
+            order_parser.document_count = self.document_count
+            order_parser._post_update(updated_languages)
+
+    def score_batch(self, tweets: List[str]) -> np.ndarray:
+        """
+        Log-linear interpolation of the sizes: their scores weighted by self.weights, then summed
+        """
+        scores = np.zeros((len(tweets), len(LANGUAGES)), dtype=np.float64)
+        for weight, order_parser in zip(self.weights, self.order_parsers):
+            if weight != 0:
+                scores += weight * order_parser.score_batch(tweets)
+        return scores
+
 
 class TFIDFWithStopWordTrainingParser(TrainingParser):
     """
     BYOM-specific training data parsing
     """
-    def __init__(self, input_file: str):
+    def __init__(self, input_file: str, tokenizer: str = 'nltk'):
         super(TFIDFWithStopWordTrainingParser, self).__init__(input_file)
-        self.language_stop_words = language_stopwords
+        self.tokenizer: str = tokenizer  # key of nlp_tools.tokenizers.TOKENIZERS
+        self.language_stop_words = load_language_stopwords()
         self.models: Dict[str: TFIDFWithStopWordTrainingModel] = {}
+        self.word_occ: Dict[str, int] = {}  # word -> number of languages using it, shared by the models
+        self.inverted_index: Dict[str, np.ndarray] = {}  # word -> weight per language
+        self.score_cache = OrderedDict()  # tweet -> scores, least recently used first
 
         for language in LANGUAGES:
-            self.models[language] = TFIDFWithStopWordTrainingModel(language, self.language_stop_words[language])
+            self.models[language] = TFIDFWithStopWordTrainingModel(language, self.language_stop_words[language],
+                                                                   tokenizer)
 
     def _insert(self, parsed_lang: str, parsed_tweet_content: str):
         """
         Inserts in corpus for tf-idf
         """
-        text_tokens = word_tokenize(parsed_tweet_content)
+        text_tokens = TOKENIZERS[self.tokenizer](parsed_tweet_content)
+        METRICS.count('tokens_inserted', len(text_tokens))
         for text_token in text_tokens:
             self.models[parsed_lang].insert(text_token)
 
+    def _merge_models(self, models: Dict[str, TFIDFWithStopWordTrainingModel]):
+        for language in self.models:
+            self.models[language].merge(models[language])
+
     def _post_parse(self, document_count: int):
         """
-        Populates IDF with number of occurences of words in other languages training corpus
-        and triggers tf-idf weight calculation
+        Counts in a single pass over every corpus the number of languages using each word, shared by all
+        models for the IDF, and triggers tf-idf weight calculation
         """
+        word_occ = {}
         for language in self.models:
-            word_occ_in_other_models = {}
+            for word in self.models[language].corpus:
+                word_occ[word] = word_occ.get(word, 0) + 1
 
-            for other_language in self.models:
-                if other_language == language:
-                    continue
+        self.word_occ = word_occ
+        with METRICS.stage('training/compute'):
+            for language in self.models:
+                self.models[language].set_word_occ_in_other_models(word_occ)
+                self.models[language].compute()
+            self._build_inverted_index()
 
-                for word in self.models[language].corpus:
-                    if word not in word_occ_in_other_models:
-                        word_occ_in_other_models[word] = 1  # at least 1 to avoid division by zero
+    def _post_update(self, updated_languages: Set[str]):
+        """
+        Only the words inserted by the update get new weights: their occurence value changed in the updated
+        languages, and their number of languages, so their idf, may have changed for every language using them
+        """
+        stale_words = set()
+        for language in updated_languages:
+            stale_words |= self.models[language].stale_words
 
-                    if word in self.models[other_language].corpus:
-                        word_occ_in_other_models[word] += 1
+        for word in stale_words:
+            self.word_occ[word] = sum(word in self.models[language].corpus for language in LANGUAGES)
+        for language in LANGUAGES:
+            self.models[language].compute_words(stale_words)
+        for word in stale_words:
+            self.inverted_index[word] = np.array([self.models[language].weights.get(word, 0.0)
+                                                  for language in LANGUAGES], dtype=np.float64)
+        self.score_cache.clear()
 
-            self.models[language].set_word_occ_in_other_models(word_occ_in_other_models)
+    def _build_inverted_index(self):
+        """
+        Merges the weights of every language, words missing from a language weigh 0
+        """
+        self.inverted_index = {}
+        self.score_cache.clear()
+        for column, language in enumerate(LANGUAGES):
+            for word, weight in self.models[language].weights.items():
+                if word not in self.inverted_index:
+                    self.inverted_index[word] = np.zeros(len(LANGUAGES), dtype=np.float64)
+                self.inverted_index[word][column] = weight
+
+    def score_tokens(self, lower_text_tokens: List[str]) -> np.ndarray:
+        """
+        Scores the lowercased tokens of a tweet against every language with one lookup per token
+        """
+        # -0.0 is the score of a language matching no token, which test_tokens() returns as the int 0, see
+        # Results.scores()
+        scores = np.full(len(LANGUAGES), -0.0, dtype=np.float64)
+        for lower_text_token in lower_text_tokens:
+            weights = self.inverted_index.get(lower_text_token)
+            if weights is not None:
+                scores += weights
+        return scores
+
+    def score_batch(self, tweets: List[str]) -> np.ndarray:
+        """
+        Tokenizes each distinct tweet once for all languages
+        """
+        scores = np.zeros((len(tweets), len(LANGUAGES)), dtype=np.float64)
+        tokens_scored = 0
+        for row, tweet in enumerate(tweets):
+            if tweet in self.score_cache:
+                self.score_cache.move_to_end(tweet)
+            else:
+                tokens = normalized_tokens(tweet, self.tokenizer)
+                tokens_scored += len(tokens)
+                self.score_cache[tweet] = self.score_tokens(tokens)
+                if len(self.score_cache) > TFIDF_SCORE_CACHE_SIZE:
+                    self.score_cache.popitem(last=False)
+            scores[row] = self.score_cache[tweet]
+        METRICS.count('tokens_scored', tokens_scored)
+        return scores
+
+    def save(self, path: str):
+        """
+        Writes the trained models to a model file: the words of every corpus, then the
+        [word, language] matrices of occurence values and tf-idf weights
+        """
+        words = sorted(set().union(*(self.models[language].corpus for language in LANGUAGES)))
+        counts = np.zeros((len(words), len(LANGUAGES)), dtype=np.int64)
+        weights = np.zeros((len(words), len(LANGUAGES)), dtype=np.float64)
+        for row, word in enumerate(words):
+            for column, language in enumerate(LANGUAGES):
+                model: TFIDFWithStopWordTrainingModel = self.models[language]
+                if word in model.corpus:
+                    counts[row, column] = model.corpus[word]
+                    weights[row, column] = model.weights[word]
+
+        header = {'kind': 'tfidf', 'languages': LANGUAGES, 'tokenizer': self.tokenizer, 'words': words,
+                  'document_count': self.document_count}
+        write_model_file(path, header, {'counts': counts, 'weights': weights})
+
+    @classmethod
+    def load(cls, path: str):
+        """
+        Loads models written by save()
+        """
+        header, arrays = read_model_file(path, 'tfidf')
+        if header['languages'] != LANGUAGES:
+            raise ValueError('{} was trained for languages {}'.format(path, header['languages']))
+
+        training_parser = cls(path, header['tokenizer'])
+        words = header['words']
+        counts = arrays['counts']
+        weights = arrays['weights']
+        word_occ = dict(zip(words, np.count_nonzero(counts, axis=1).tolist()))
+        for column, language in enumerate(LANGUAGES):
+            model: TFIDFWithStopWordTrainingModel = training_parser.models[language]
+            rows = np.flatnonzero(counts[:, column]).tolist()
+            model.corpus = {words[row]: count for row, count in zip(rows, counts[rows, column].tolist())}
+            model.weights = {words[row]: weight for row, weight in zip(rows, weights[rows, column].tolist())}
+            model.set_word_occ_in_other_models(word_occ)
+            model.stale_words = set()
+        training_parser.word_occ = word_occ
+        training_parser.inverted_index = dict(zip(words, weights))
+        # missing from the files written before it was saved
+        training_parser.document_count = header.get('document_count', 0)
+        return training_parser
+
+
+# trained parser of a test worker process, set once by _set_scoring_parser()
+_scoring_parser = None
 
-        for language in self.models:
-            self.models[language].compute()
+
+def _set_scoring_parser(training_parser):
+    global _scoring_parser
+    _scoring_parser = training_parser
+
+
+def _score_tweets(tweets: List[str]) -> Tuple[np.ndarray, Counter, Counter]:
+    return _scoring_parser.score_batch(tweets), METRICS.take_counters(), _scoring_parser.take_scoring_stats()
 
 
 class TestParser(ABC):
     """
     Abstract class for test data parser
     """
-    def __init__(self, training_parser: TrainingParser, input_test_file: str):
+    def __init__(self, training_parser: TrainingParser, input_test_file: str, trace_format: str = 'text',
+                 compress_trace: bool = False):
         self.training_parser: TrainingParser = training_parser
-        self.input_test_file: str = input_test_file
+        self.input_test_file = input_test_file  # path, '-' for stdin, or iterable of lines or records
+        self.trace_format = trace_format  # key of writers.TRACE_WRITERS
+        self.compress_trace = compress_trace
+        self.trace_writer: TraceWriter = None  # open while parsing
         self.count = 0
-        self.results: List[List[Score]] = []
-        self.trace_output: str = ''
+        self.correct = 0
+        self.results = Results()
         self.final_accuracy = 0.0
         self.final_macro_f1 = 0.0
         self.final_weighed_avg_f1 = 0.0
         self.class_scores: Dict[str, ClassScore] = {}
         self.class_occ: Dict[str, int] = {}
 
-    def _output_to_trace_file(self):
+    def _trace_path(self):
         cur_dir = os.path.dirname(__file__)
-        abs_trace_path = os.path.join(cur_dir, self._output_trace_file_name())
-        trace_f = open(abs_trace_path, "w+")
-        trace_f.write(self.trace_output)
-        trace_f.close()
+        return trace_path(os.path.join(cur_dir, self._output_trace_file_name()), self.trace_format,
+                          self.compress_trace)
 
     @abstractmethod
     def _output_eval_file_name(self):
@@ -203,17 +734,10 @@ class TestParser(ABC):
 
     def _process_results(self):
         """
-        Sorts scores into a list of Score obj
+        Ends the trace with the accuracy, then computes the stats
         """
-        correct = 0
-        result: List[Score]  # sorted in reverse order
-        for result in self.results:
-            self.trace_output += str(result[0])  # gets largest score
-            correct += 1 if result[0].is_correct else 0
-
-        self.final_accuracy = correct / len(self.results)
-        self.trace_output += '\n\nAccuracy: {}'.format(self.final_accuracy)
-        self._output_to_trace_file()
+        self.final_accuracy = self.correct / len(self.results)
+        self.trace_writer.write_accuracy(self.final_accuracy)
         self._run_stats()
 
         for class_score in self.class_scores:
@@ -229,21 +753,17 @@ class TestParser(ABC):
             if lang_ in self.class_occ:
                 class_scores_[lang_] = ClassScore(self.class_occ[lang_])
 
-        result_list: List[Score]  # sorted in reverse order
-        for result_list in self.results:
-            for count, score in enumerate(result_list):
-                first = count == 0
-                correct = score.is_correct
-
-                if score.guessed_lang in class_scores_:
-                    if first and correct:
-                        class_scores_[score.guessed_lang].true_positive += 1
-                    elif first and not correct:
-                        class_scores_[score.guessed_lang].false_positive += 1
-                    elif not first and correct:
-                        class_scores_[score.guessed_lang].false_negative += 1
-                    elif not first and not correct:
-                        class_scores_[score.guessed_lang].true_negative += 1
+        # rows are guessed languages, columns actual ones. Actual languages outside of LANGUAGES are never
+        # guessed, their counts stay at 0
+        confusion = self.results.confusion_matrix()
+        for index, lang_ in enumerate(LANGUAGES):
+            if lang_ in class_scores_:
+                true_positive = int(confusion[index, index])
+                class_scores_[lang_].true_positive = true_positive
+                class_scores_[lang_].false_positive = int(confusion[index].sum()) - true_positive
+                class_scores_[lang_].false_negative = int(confusion[:, index].sum()) - true_positive
+                class_scores_[lang_].true_negative = len(self.results) - true_positive \
+                    - class_scores_[lang_].false_positive - class_scores_[lang_].false_negative
 
         for lang_ in class_scores_:
             if class_scores_[lang_].true_positive != 0 or class_scores_[lang_].false_positive != 0:
@@ -262,54 +782,128 @@ class TestParser(ABC):
 
         self.class_scores = class_scores_
         self.final_macro_f1 = sum([class_scores_[lang_].f1 for lang_ in class_scores_]) / len(class_scores_)
-        self.final_weighed_avg_f1 = sum([class_scores_[lang].f1 * class_scores_[lang_].count
+        self.final_weighed_avg_f1 = sum([class_scores_[lang_].f1 * class_scores_[lang_].count
                                          for lang_ in class_scores_]) / self.count
 
-        self._output_to_eval_file()
+        with METRICS.stage('testing/eval_output'):
+            self._output_to_eval_file()
 
-    def parse(self):
+    def _batches(self, lines) -> Iterator[List[tuple]]:
+        """
+        Groups the (tweet id, language, tweet) of the test records into batches of TEST_BATCH_SIZE
+        """
+        batch = []
+        record: TweetRecord
+        for record in iter_records(lines, self._skip_line):
+            if record.language not in self.class_occ:
+                self.class_occ[record.language] = 1
+            else:
+                self.class_occ[record.language] += 1
+
+            self.count += 1
+            batch.append((record.tweet_id, record.language, record.content))
+            if len(batch) == TEST_BATCH_SIZE:
+                yield batch
+                batch = []
+
+        if batch:
+            yield batch
+
+    def _scored_batches(self, batches: Iterator[List[tuple]], workers: int) \
+            -> Iterator[Tuple[List[tuple], np.ndarray]]:
+        """
+        Yields every batch with its scores, in input order
+        With several workers, batches are scored in a process pool holding the trained parser read-only:
+        inherited on fork, or sent once to each worker otherwise
+        """
+        if workers <= 1:
+            for batch in batches:
+                with METRICS.stage('testing/score'):
+                    scores = self.training_parser.score_batch([tweet for _, _, tweet in batch])
+                yield batch, scores
+            return
+
+        if 'fork' in multiprocessing.get_all_start_methods():
+            context = multiprocessing.get_context('fork')
+        else:
+            context = multiprocessing.get_context()
+        with ProcessPoolExecutor(workers, mp_context=context, initializer=_set_scoring_parser,
+                                 initargs=(self.training_parser,)) as executor:
+            pending = deque()
+            for batch in batches:
+                pending.append((batch, executor.submit(_score_tweets, [tweet for _, _, tweet in batch])))
+                # bounds the batches held in memory while keeping every worker busy
+                if len(pending) > 2 * workers:
+                    yield self._scored_batch(*pending.popleft())
+            while pending:
+                yield self._scored_batch(*pending.popleft())
+
+    def _scored_batch(self, batch: List[tuple], scores: Future) -> Tuple[List[tuple], np.ndarray]:
+        """
+        Waits for the scores of a batch from a worker, and adds the counters and scoring stats of the worker
+        to this process
+        """
+        with METRICS.stage('testing/score'):
+            lang_scores, counters, scoring_stats = scores.result()
+        METRICS.add_counters(counters)
+        self.training_parser.scoring_stats.update(scoring_stats)
+        return batch, lang_scores
+
+    def parse(self, workers: int = 1):
         """
         Parses tweet to extract features and run it on the model's insert() function
         """
+        with METRICS.stage('testing'):
+            self._parse(workers)
+
+    def _parse(self, workers: int):
         try:
-            f = open(self.input_test_file, "r")
+            source = open_lines(self.input_test_file)
         except FileNotFoundError as e:
             print(e)
             print("Please input a test file that exists.")
             exit(1)
 
-        lines: List[str] = f.readlines()
-        for line in lines:
-            try:
-                line_info: List[str] = line.split('\t')
-                parsed_tweet_id = line_info[0]
-                parsed_username = line_info[1]
-                parsed_language = line_info[2]
-                parsed_tweet_content = line_info[3]
-            except IndexError as e:
-                print('Skipped testing for: {}'.format(line))
-                continue
-
-            if parsed_language not in self.class_occ:
-                self.class_occ[parsed_language] = 1
-            else:
-                self.class_occ[parsed_language] += 1
-
-            self.count += 1
-            scores_for_tweet = []
-            for language in LANGUAGES:
-                lang_score: float = self.training_parser.models[language].test(parsed_tweet_content)
-                scores_for_tweet.append(Score(
-                    parsed_tweet_id,
-                    lang_score,
-                    language,
-                    parsed_language
-                ))
-
-            sorted_scores = sorted(scores_for_tweet, key=lambda x: x.score, reverse=True)
-            self.results.append(sorted_scores)
-
-        self._process_results()
+        progress = ProgressReporter('testing')
+        self.training_parser.take_scoring_stats()
+        with TRACE_WRITERS[self.trace_format](self._trace_path()) as self.trace_writer:
+            with source as lines:
+                for batch, lang_scores in self._scored_batches(self._batches(progress.track(lines)), workers):
+                    with METRICS.stage('testing/trace_output'):
+                        self._add_results(batch, lang_scores)
+            progress.done()
+            self._report_scoring_stats()
+            with METRICS.stage('testing/process_results'):
+                self._process_results()
+        self.trace_writer = None
+        METRICS.count('tweets_scored', self.count)
+
+    def _report_scoring_stats(self):
+        """
+        Average number of n-grams scored per tweet and language, when the scorer dropped languages
+        """
+        scoring_stats = self.training_parser.scoring_stats
+        if scoring_stats['ngrams']:
+            print('Early exit: {:.1f} n-grams scored per tweet and language instead of {:.1f} ({:.1%})'.format(
+                scoring_stats['lookups'] / (scoring_stats['tweets'] * len(LANGUAGES)),
+                scoring_stats['ngrams'] / scoring_stats['tweets'],
+                scoring_stats['lookups'] / (scoring_stats['ngrams'] * len(LANGUAGES))))
+
+    @staticmethod
+    def _skip_line(line: str):
+        print('Skipped testing for: {}'.format(line))
+
+    def _add_results(self, batch: List[tuple], lang_scores: np.ndarray):
+        """
+        Keeps the best of the scores of a batch of (tweet id, language, tweet) against every language model,
+        and traces them
+        """
+        tweet_ids = [parsed_tweet_id for parsed_tweet_id, _, _ in batch]
+        records = self.results.add_batch(tweet_ids, [parsed_language for _, parsed_language, _ in batch],
+                                         lang_scores)
+        for result in self.results.scores(tweet_ids, records):
+            self.trace_writer.write(result)
+            self.correct += 1 if result.is_correct else 0
 
 
 class NgramTestParser(TestParser):
@@ -318,8 +912,9 @@ class NgramTestParser(TestParser):
     Pre-condition: NgramTrainingDataParser object created and trained (parse() function was ran)
     """
 
-    def __init__(self, parser: NgramTrainingDataParser, input_test_file: str):
-        super(NgramTestParser, self).__init__(parser, input_test_file)
+    def __init__(self, parser: NgramTrainingDataParser, input_test_file: str, trace_format: str = 'text',
+                 compress_trace: bool = False):
+        super(NgramTestParser, self).__init__(parser, input_test_file, trace_format, compress_trace)
         self.training_parser = parser
 
     def _output_eval_file_name(self):
@@ -338,8 +933,9 @@ class StopWordTestParser(TestParser):
     Class that runs test file against trained stop word models
     """
 
-    def __init__(self, parser: TFIDFWithStopWordTrainingParser, input_test_file: str):
-        super(StopWordTestParser, self).__init__(parser, input_test_file)
+    def __init__(self, parser: TFIDFWithStopWordTrainingParser, input_test_file: str, trace_format: str = 'text',
+                 compress_trace: bool = False):
+        super(StopWordTestParser, self).__init__(parser, input_test_file, trace_format, compress_trace)
         self.training_parser = parser
 
     def _output_eval_file_name(self):
@@ -347,3 +943,24 @@ class StopWordTestParser(TestParser):
 
     def _output_trace_file_name(self):
         return REL_PATH_TO_TRACE_BYOM
+
+
+class InterpolatedTestParser(TestParser):
+    """
+    Class that runs a test file against the interpolation of the n-gram sizes of multi-order models
+    """
+
+    def __init__(self, parser: MultiOrderNgramTrainingDataParser, input_test_file: str, trace_format: str = 'text',
+                 compress_trace: bool = False):
+        super(InterpolatedTestParser, self).__init__(parser, input_test_file, trace_format, compress_trace)
+        self.training_parser = parser
+
+    def _output_eval_file_name(self):
+        return REL_PATH_TO_EVAL_INTERPOLATED.format(self.training_parser.vocabulary,
+                                                    self.training_parser.max_ngram_size,
+                                                    self.training_parser.smoothing)
+
+    def _output_trace_file_name(self):
+        return REL_PATH_TO_TRACE_INTERPOLATED.format(self.training_parser.vocabulary,
+                                                     self.training_parser.max_ngram_size,
+                                                     self.training_parser.smoothing)
@@ -0,0 +1,75 @@
+from typing import Dict, Tuple
+
+import json
+import numpy as np
+import struct
+
+# File layout:
+#   magic | format version (uint32) | header length (uint32) | JSON header | arrays
+# Every array starts on an ARRAY_ALIGNMENT boundary so it can be memory-mapped in place.
+MAGIC = b'NLPMODEL'
+FORMAT_VERSION = 1
+ARRAY_ALIGNMENT = 64
+_PREAMBLE = struct.Struct('<8sII')
+
+
+class ModelFileException(Exception):
+    pass
+
+
+def _aligned(offset: int) -> int:
+    return (offset + ARRAY_ALIGNMENT - 1) // ARRAY_ALIGNMENT * ARRAY_ALIGNMENT
+
+
+def write_model_file(path: str, header: dict, arrays: Dict[str, np.ndarray]):
+    """
+    Writes the header, with the offset, dtype and shape of every array, followed by the arrays
+    """
+    arrays = {name: np.ascontiguousarray(array) for name, array in arrays.items()}
+    layout = {}
+    offset = 0
+    for name, array in arrays.items():
+        layout[name] = {'offset': offset, 'dtype': array.dtype.str, 'shape': list(array.shape)}
+        offset = _aligned(offset + array.nbytes)
+
+    encoded_header = json.dumps(dict(header, arrays=layout)).encode('utf-8')
+    data_start = _aligned(_PREAMBLE.size + len(encoded_header))
+    with open(path, 'wb') as f:
+        f.write(_PREAMBLE.pack(MAGIC, FORMAT_VERSION, len(encoded_header)))
+        f.write(encoded_header)
+        for name, array in arrays.items():
+            f.seek(data_start + layout[name]['offset'])
+            f.write(array.tobytes())
+        f.truncate(data_start + offset)
+
+
+def read_model_file(path: str, kind: str) -> Tuple[dict, Dict[str, np.ndarray]]:
+    """
+    Reads the header and memory-maps the arrays of a model file written by write_model_file().
+    Arrays are copy-on-write: processes loading the same file share its page-cached copy
+    until one of them modifies an array
+    """
+    with open(path, 'rb') as f:
+        preamble = f.read(_PREAMBLE.size)
+        if len(preamble) != _PREAMBLE.size:
+            raise ModelFileException('{} is not a model file'.format(path))
+        magic, version, header_length = _PREAMBLE.unpack(preamble)
+        if magic != MAGIC:
+            raise ModelFileException('{} is not a model file'.format(path))
+        if version != FORMAT_VERSION:
+            raise ModelFileException('{} uses model format {}, expected {}'.format(path, version, FORMAT_VERSION))
+        header = json.loads(f.read(header_length).decode('utf-8'))
+
+    if header.get('kind') != kind:
+        raise ModelFileException('{} holds a {} model, expected {}'.format(path, header.get('kind'), kind))
+
+    data_start = _aligned(_PREAMBLE.size + header_length)
+    arrays = {}
+    for name, layout in header.pop('arrays').items():
+        dtype = np.dtype(layout['dtype'])
+        shape = tuple(layout['shape'])
+        if int(np.prod(shape)) == 0:
+            arrays[name] = np.zeros(shape, dtype=dtype)
+        else:
+            arrays[name] = np.memmap(path, dtype=dtype, mode='c', offset=data_start + layout['offset'], shape=shape)
+    return header, arrays
@@ -0,0 +1,155 @@
+from contextlib import nullcontext
+from typing import Callable, Iterable, Iterator, NamedTuple, Optional, Union
+
+import bz2
+import gzip
+import locale
+import lzma
+import os
+import sys
+import time
+
+COMPRESSED_OPENERS = {
+    '.gz': gzip.open,
+    '.bz2': bz2.open,
+    '.xz': lzma.open
+}
+STDIN_PATH = '-'
+PROGRESS_INTERVAL = 5.0  # seconds between two progress reports
+
+
+class TweetRecord(NamedTuple):
+    """
+    One line of a training or test file
+    """
+    tweet_id: str
+    username: str
+    language: str
+    content: str
+
+
+class MalformedRecordException(Exception):
+    pass
+
+
+def open_lines(source: Union[str, Iterable]):
+    """
+    Opens the lines of source for a with statement. Source is a path (compressed by .gz, .bz2 or .xz,
+    '-' for stdin) or any iterable of lines or records, used as is.
+    Raises FileNotFoundError right away for a missing path
+    """
+    if not isinstance(source, str):
+        return nullcontext(source)
+    if source == STDIN_PATH:
+        return nullcontext(sys.stdin)
+    for extension, opener in COMPRESSED_OPENERS.items():
+        if source.endswith(extension):
+            return opener(source, 'rt')
+    return open(source, 'r')
+
+
+def is_plain_file(source: Union[str, Iterable]) -> bool:
+    """
+    Whether source is an uncompressed file that can be read from any byte offset
+    """
+    return isinstance(source, str) and source != STDIN_PATH \
+        and not source.endswith(tuple(COMPRESSED_OPENERS)) and os.path.isfile(source)
+
+
+def byte_ranges(path: str, count: int):
+    """
+    Splits a file in count contiguous [start, end) byte ranges of about the same size
+    """
+    size = os.path.getsize(path)
+    bounds = [size * part // count for part in range(count + 1)]
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def read_byte_range(path: str, start: int, end: int) -> Iterator[str]:
+    """
+    Yields the lines starting within [start, end) of a file, decoded like open(path, 'r') would.
+    A line straddling start belongs to the previous range
+    """
+    encoding = locale.getpreferredencoding(False)
+    with open(path, 'rb') as f:
+        if start > 0:
+            f.seek(start - 1)
+            f.readline()
+        position = f.tell()
+        while position < end:
+            line = f.readline()
+            if not line:
+                break
+            position += len(line)
+            if line.endswith(b'\r\n'):
+                line = line[:-2] + b'\n'
+            yield line.decode(encoding)
+
+
+def parse_record(line: str) -> TweetRecord:
+    """
+    Splits a tab separated line, the content keeps its line ending
+    """
+    line_info = line.split('\t')
+    if len(line_info) < 4:
+        raise MalformedRecordException('Malformed line: {}'.format(line))
+    return TweetRecord(line_info[0], line_info[1], line_info[2], line_info[3])
+
+
+def iter_records(lines: Iterable, on_malformed: Optional[Callable[[str], None]] = None) -> Iterator[TweetRecord]:
+    """
+    Lazily turns lines into records, items that already are (tweet_id, username, language, content)
+    tuples are passed through. Malformed lines are given to on_malformed, or raise if there is none
+    """
+    for line in lines:
+        if not isinstance(line, str):
+            yield TweetRecord(*line)
+            continue
+
+        try:
+            yield parse_record(line)
+        except MalformedRecordException:
+            if on_malformed is None:
+                raise
+            on_malformed(line)
+
+
+class ProgressReporter:
+    """
+    Reports on stderr how many rows went through a stage and at which rate
+    """
+
+    def __init__(self, stage: str, interval: float = PROGRESS_INTERVAL, stream=None):
+        self.stage = stage
+        self.interval = interval
+        self.stream = stream if stream is not None else sys.stderr
+        self.rows = 0
+        self.start = time.perf_counter()
+        self.last_report = self.start
+
+    def _report(self, now: float, final: bool):
+        elapsed = now - self.start
+        rate = self.rows / elapsed if elapsed > 0 else 0.0
+        print('{}: {} rows{} ({:.0f} rows/s)'.format(
+            self.stage,
+            self.rows,
+            ' in {:.2f}s'.format(elapsed) if final else '',
+            rate
+        ), file=self.stream)
+        self.last_report = now
+
+    def track(self, records: Iterable) -> Iterator:
+        """
+        Passes records through while counting them
+        """
+        for record in records:
+            self.rows += 1
+            # the clock is only read every 1024 rows
+            if self.rows & 1023 == 0:
+                now = time.perf_counter()
+                if now - self.last_report >= self.interval:
+                    self._report(now, False)
+            yield record
+
+    def done(self):
+        self._report(time.perf_counter(), True)
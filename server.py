@@ -0,0 +1,230 @@
+from language import LANGUAGES
+from parser import TrainingParser
+from metrics import METRICS
+from collections import deque
+from typing import List, Optional, Tuple
+
+import asyncio
+import json
+import numpy as np
+import os
+import sys
+import time
+
+MAX_BATCH_SIZE = 256
+MAX_WAIT = 0.005  # seconds the first tweet of a batch may wait for others
+LATENCY_WINDOW = 1 << 16  # latencies kept for the percentiles
+THROUGHPUT_WINDOW = 1 << 10  # batches kept for the throughput
+IDLE_GAP = 1.0  # seconds without tweets to score after which the throughput is measured again from scratch
+REPORT_INTERVAL = 10.0  # seconds between two stats reports
+
+
+class LatencyStats:
+    """
+    Latencies of the most recent requests, from queueing to scoring, and throughput of the most recent batches,
+    from the time the first of them was queued to the time the last one was scored. Batches before the server
+    sat idle for IDLE_GAP are left out, so that idle time does not count
+    """
+
+    def __init__(self, window: int = LATENCY_WINDOW):
+        self.latencies = deque(maxlen=window)
+        self.recent_batches = deque(maxlen=THROUGHPUT_WINDOW)  # (time first queued, tweets) of the last batches
+        self.last_scored = 0.0
+        self.served = 0
+        self.batches = 0
+
+    def record_batch(self, queued: List[float], scored: float):
+        """
+        Records a batch from the times its tweets were queued, in order, and the time it was scored
+        """
+        self.latencies.extend(scored - tweet_queued for tweet_queued in queued)
+        if queued[0] - self.last_scored > IDLE_GAP:
+            self.recent_batches.clear()
+        self.recent_batches.append((queued[0], len(queued)))
+        self.last_scored = scored
+        self.served += len(queued)
+        self.batches += 1
+
+    def summary(self) -> dict:
+        p50, p99 = np.percentile(self.latencies, [50, 99]).tolist() if self.latencies else (0.0, 0.0)
+        elapsed = self.last_scored - self.recent_batches[0][0] if self.recent_batches else 0.0
+        return {
+            'served': self.served,
+            'batches': self.batches,
+            'mean_batch_size': self.served / self.batches if self.batches else 0.0,
+            'p50_ms': p50 * 1000,
+            'p99_ms': p99 * 1000,
+            'throughput': sum(tweets for _, tweets in self.recent_batches) / elapsed if elapsed > 0 else 0.0
+        }
+
+    def report(self, stream=None):
+        print('serve: {served} tweets in {batches} batches (mean size {mean_batch_size:.1f}), '
+              'p50 {p50_ms:.2f}ms, p99 {p99_ms:.2f}ms, {throughput:.0f} tweets/s'.format(**self.summary()),
+              file=stream if stream is not None else sys.stderr)
+
+
+class ClassificationServer:
+    """
+    Answers classification requests sent as JSON lines over TCP or a Unix socket:
+        {"id": 1, "tweet": "..."} -> {"id": 1, "language": "es", "scores": {"eu": ..., [...]}}
+        {"stats": true} -> latency percentiles and throughput
+    Tweets of every connection are queued and scored together by one score_batch() call per batch
+    of at most max_batch_size tweets, the first tweet of a batch waiting at most max_wait for the others
+    """
+
+    def __init__(self, training_parser: TrainingParser, max_batch_size: int = MAX_BATCH_SIZE,
+                 max_wait: float = MAX_WAIT):
+        self.training_parser = training_parser
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.stats = LatencyStats()
+        self._pending: List[Tuple[str, asyncio.Future, float]] = []  # (tweet, future, time queued)
+        self._arrived: Optional[asyncio.Event] = None
+
+    async def classify(self, tweet: str) -> np.ndarray:
+        """
+        Scores of a tweet against every language, once its batch is scored
+        """
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((tweet, future, time.perf_counter()))
+        self._arrived.set()
+        return await future
+
+    async def _next_batch(self) -> List[Tuple[str, asyncio.Future, float]]:
+        await self._arrived.wait()
+        while len(self._pending) < self.max_batch_size:
+            remaining = self.max_wait - (time.perf_counter() - self._pending[0][2])
+            if remaining <= 0:
+                break
+            self._arrived.clear()
+            try:
+                await asyncio.wait_for(self._arrived.wait(), remaining)
+            except asyncio.TimeoutError:
+                break
+
+        batch = self._pending[:self.max_batch_size]
+        del self._pending[:self.max_batch_size]
+        if self._pending:
+            self._arrived.set()
+        else:
+            self._arrived.clear()
+        return batch
+
+    async def _score_batches(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._next_batch()
+            try:
+                # scored in a thread so that connections keep being served meanwhile
+                scores = await loop.run_in_executor(None, self.training_parser.score_batch,
+                                                    [tweet for tweet, _, _ in batch])
+            except Exception as e:
+                for _, future, _ in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+
+            now = time.perf_counter()
+            METRICS.count('tweets_scored', len(batch))
+            for (_, future, _), tweet_scores in zip(batch, scores):
+                if not future.done():
+                    future.set_result(tweet_scores)
+            self.stats.record_batch([queued for _, _, queued in batch], now)
+
+    async def _respond(self, line: bytes) -> dict:
+        try:
+            request = json.loads(line)
+        except ValueError:
+            return {'error': 'invalid JSON'}
+        if not isinstance(request, dict):
+            return {'error': 'requests are JSON objects'}
+        if request.get('stats'):
+            return self.stats.summary()
+
+        tweet = request.get('tweet')
+        if not isinstance(tweet, str):
+            return {'id': request.get('id'), 'error': 'missing "tweet" string'}
+        try:
+            scores = await self.classify(tweet)
+        except Exception as e:
+            return {'id': request.get('id'), 'error': str(e)}
+        return {
+            'id': request.get('id'),
+            'language': LANGUAGES[int(np.argmax(scores))],
+            # + 0.0 writes the -0.0 of languages matching no token as 0.0
+            'scores': dict(zip(LANGUAGES, (scores + 0.0).tolist()))
+        }
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """
+        Requests of a connection are answered in order, pipelined ones are scored in the same batches
+        """
+        responses = asyncio.Queue()
+
+        async def send():
+            while True:
+                response = await responses.get()
+                if response is None:
+                    return
+                writer.write((json.dumps(await response) + '\n').encode('utf-8'))
+                await writer.drain()
+
+        sender = asyncio.ensure_future(send())
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                if line.strip():
+                    responses.put_nowait(asyncio.ensure_future(self._respond(line)))
+            responses.put_nowait(None)
+            await sender
+        except ConnectionError:
+            sender.cancel()
+        finally:
+            writer.close()
+
+    async def _report(self, interval: float):
+        served = 0
+        while True:
+            await asyncio.sleep(interval)
+            if self.stats.served != served:
+                served = self.stats.served
+                self.stats.report()
+
+    async def run(self, host: str = None, port: int = None, unix_path: str = None,
+                  report_interval: float = REPORT_INTERVAL):
+        """
+        Serves on a Unix socket when unix_path is given, on host:port otherwise, until cancelled
+        """
+        self._arrived = asyncio.Event()
+        if unix_path is not None:
+            server = await asyncio.start_unix_server(self._handle, unix_path)
+        else:
+            server = await asyncio.start_server(self._handle, host, port)
+        print('serve: listening on {}'.format(unix_path if unix_path is not None else '{}:{}'.format(host, port)),
+              file=sys.stderr)
+
+        tasks = [asyncio.ensure_future(self._score_batches()), asyncio.ensure_future(self._report(report_interval))]
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            for task in tasks:
+                task.cancel()
+            if unix_path is not None and os.path.exists(unix_path):
+                os.unlink(unix_path)
+
+
+def serve(training_parser: TrainingParser, host: str = None, port: int = None, unix_path: str = None,
+          max_batch_size: int = MAX_BATCH_SIZE, max_wait: float = MAX_WAIT):
+    """
+    Runs a ClassificationServer until interrupted, then reports its stats
+    """
+    classification_server = ClassificationServer(training_parser, max_batch_size, max_wait)
+    try:
+        asyncio.run(classification_server.run(host, port, unix_path))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        classification_server.stats.report()
@@ -0,0 +1,131 @@
+from parser import NgramTrainingDataParser, NgramTestParser, MultiOrderNgramTrainingDataParser
+from metrics import METRICS
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import redirect_stdout
+from typing import Dict, List, Tuple
+
+import io
+import multiprocessing
+import os
+
+REL_PATH_TO_SWEEP_SUMMARY = "./output/sweep_summary.txt"
+
+# trained parsers of a sweep worker process, set once by _set_sweep_parsers()
+_sweep_parsers = []
+
+
+def parse_values(spec: str, value_type=float) -> list:
+    """
+    Values of a comma separated list whose items are single values or inclusive start:stop[:step] ranges,
+    e.g. '0,0.1:0.5:0.1' for 0, 0.1, 0.2, 0.3, 0.4 and 0.5. The step defaults to 1
+    """
+    values = []
+    for item in spec.split(','):
+        if ':' not in item:
+            values.append(value_type(item))
+            continue
+        bounds = item.split(':')
+        if len(bounds) not in (2, 3):
+            raise ValueError('range {} is not start:stop[:step]'.format(item))
+        start, stop, step = (value_type(bound) for bound in (bounds + ['1'])[:3])
+        if step <= 0 or stop < start:
+            raise ValueError('range {} needs a positive step and stop >= start'.format(item))
+        count = int(round((stop - start) / step, 9)) + 1
+        # rounded so that 0.1 * 3 is written 0.3 in the file names
+        values.extend(value_type(round(start + index * step, 9)) for index in range(count))
+    return values
+
+
+def _set_sweep_parsers(training_parsers: List[NgramTrainingDataParser]):
+    global _sweep_parsers
+    _sweep_parsers = training_parsers
+
+
+def _test_config(index: int, testing_file: str, trace_format: str,
+                 compress_trace: bool) -> Tuple[float, float, float]:
+    """
+    Writes the trace and eval files of one configuration, returns its accuracy, macro-F1 and weighed-average-F1
+    """
+    test_parser = NgramTestParser(_sweep_parsers[index], testing_file, trace_format, compress_trace)
+    # the class scores of every configuration would interleave, the summary replaces them
+    with redirect_stdout(io.StringIO()):
+        test_parser.parse()
+    return test_parser.final_accuracy, test_parser.final_macro_f1, test_parser.final_weighed_avg_f1
+
+
+def _counted_test_config(index: int, testing_file: str, trace_format: str,
+                         compress_trace: bool) -> Tuple[Tuple[float, float, float], Counter]:
+    """
+    Tests a configuration in a worker process, returns its scores with the counters of the worker
+    """
+    return _test_config(index, testing_file, trace_format, compress_trace), METRICS.take_counters()
+
+
+def _tested_configs(training_parsers: List[NgramTrainingDataParser], testing_file: str, trace_format: str,
+                    compress_trace: bool, workers: int) -> List[Tuple[float, float, float]]:
+    if workers <= 1:
+        _set_sweep_parsers(training_parsers)
+        return [_test_config(index, testing_file, trace_format, compress_trace)
+                for index in range(len(training_parsers))]
+
+    if 'fork' in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context('fork')
+    else:
+        context = multiprocessing.get_context()
+    with ProcessPoolExecutor(workers, mp_context=context, initializer=_set_sweep_parsers,
+                             initargs=(training_parsers,)) as executor:
+        tests = [executor.submit(_counted_test_config, index, testing_file, trace_format, compress_trace)
+                 for index in range(len(training_parsers))]
+        scores = []
+        for test in tests:
+            config_scores, counters = test.result()
+            METRICS.add_counters(counters)
+            scores.append(config_scores)
+        return scores
+
+
+def _trained_sizes(vocabulary: int, ngram_sizes: List[int], smoothing: float, training_file: str, storage: str,
+                   workers: int) -> Dict[int, NgramTrainingDataParser]:
+    """
+    Trained parser of every n-gram size, all of them trained in one pass over the training file
+    """
+    if len(ngram_sizes) == 1:
+        training_parser = NgramTrainingDataParser(training_file, ngram_sizes[0], vocabulary, smoothing, storage)
+        training_parser.parse(workers)
+        return {ngram_sizes[0]: training_parser}
+
+    multi_order_parser = MultiOrderNgramTrainingDataParser(training_file, max(ngram_sizes), vocabulary, smoothing,
+                                                           storage)
+    multi_order_parser.parse(workers)
+    return {ngram_size: multi_order_parser.order_parser(ngram_size) for ngram_size in ngram_sizes}
+
+
+def sweep(vocabularies: List[int], ngram_sizes: List[int], smoothings: List[float], training_file: str,
+          testing_file: str, storage: str = 'auto', workers: int = 1, trace_format: str = 'text',
+          compress_trace: bool = False):
+    """
+    Trains the counts of every n for each v in one pass, derives the models of every smoothing value from them and
+    tests every (v, n, delta) configuration, workers at a time. Writes the eval and trace files of every
+    configuration, then a summary table
+    """
+    summary = []
+    for vocabulary in vocabularies:
+        trained_sizes = _trained_sizes(vocabulary, ngram_sizes, smoothings[0], training_file, storage, workers)
+        for ngram_size in ngram_sizes:
+            training_parser = trained_sizes[ngram_size]
+            training_parsers = [training_parser] + training_parser.with_smoothings(smoothings[1:])
+            for smoothing, scores in zip(smoothings, _tested_configs(training_parsers, testing_file, trace_format,
+                                                                      compress_trace, workers)):
+                summary.append((vocabulary, ngram_size, smoothing) + scores)
+
+    lines = ['v\tn\tdelta\taccuracy\tmacro-F1\tweighed-avg-F1']
+    lines += ['{}\t{}\t{}\t{}\t{}\t{}'.format(*row) for row in summary]
+    best = max(summary, key=lambda row: row[3])
+    lines.append('\nBest accuracy: v={} n={} delta={} ({})'.format(*best[:4]))
+
+    cur_dir = os.path.dirname(__file__)
+    with open(os.path.join(cur_dir, REL_PATH_TO_SWEEP_SUMMARY), 'w') as summary_f:
+        summary_f.write('\n'.join(lines) + '\n')
+    print('\n'.join(lines))
+    return summary
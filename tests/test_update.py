@@ -0,0 +1,102 @@
+"""
+Models trained in several steps, by update(), after a save() and load(), or on shards merged together, must
+score exactly like a model trained on all the records at once.
+
+usage: python -m pytest tests
+"""
+import contextlib
+import io
+import itertools
+import os
+import sys
+import tempfile
+import unittest
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from language import LANGUAGES  # noqa: E402
+from parser import NgramTrainingDataParser, TFIDFWithStopWordTrainingParser  # noqa: E402
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+TRAINING_FILE = os.path.join(ROOT, 'input', 'training-tweets.txt')
+TESTING_FILE = os.path.join(ROOT, 'input', 'test-tweets-given.txt')
+TRAINING_STEP = 6  # every 6th training line, covering every language
+TESTING_LINES = 300
+
+# (vocabulary, n, storage) of the n-gram models checked
+NGRAM_CONFIGS = [(0, 2, 'dense'), (1, 3, 'dense'), (2, 3, 'sparse'), (1, 2, 'sparse')]
+
+
+def read_lines(path: str, stop: int = None, step: int = 1):
+    with open(path, encoding='utf-8') as f:
+        return [line for line in itertools.islice(f, 0, stop, step) if line.count('\t') >= 3]
+
+
+class UpdateTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.lines = read_lines(TRAINING_FILE, step=TRAINING_STEP)
+        cls.tweets = [line.split('\t', 3)[3] for line in read_lines(TESTING_FILE, TESTING_LINES)]
+        cls.directory = tempfile.TemporaryDirectory()
+        cls.training_file = os.path.join(cls.directory.name, 'training.txt')
+        with open(cls.training_file, 'w', encoding='utf-8') as f:
+            f.writelines(cls.lines)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.directory.cleanup()
+
+    @staticmethod
+    def trained(training_parser, workers: int = 1):
+        # training reports go to stdout and stderr
+        with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+            training_parser.parse(workers)
+        return training_parser
+
+    def assertSameScores(self, expected, actual):
+        self.assertEqual(expected.document_count, actual.document_count)
+        self.assertTrue(np.array_equal(expected.score_batch(self.tweets), actual.score_batch(self.tweets)))
+        for language in LANGUAGES:
+            self.assertEqual([expected.models[language].test(tweet) for tweet in self.tweets[:50]],
+                             [actual.models[language].test(tweet) for tweet in self.tweets[:50]])
+
+    def check_update(self, new_parser, load):
+        """
+        Trains a parser of new_parser(input_file) on every line, and others on every other line followed by
+        update() with the remaining ones, without and with a save() and load() in between
+        """
+        full = self.trained(new_parser(self.lines))
+
+        updated = self.trained(new_parser(self.lines[::2]))
+        updated.update(self.lines[1::2])
+        self.assertSameScores(full, updated)
+
+        model_file = os.path.join(self.directory.name, 'model.bin')
+        self.trained(new_parser(self.lines[::2])).save(model_file)
+        loaded = load(model_file)
+        loaded.update(self.lines[1::2])
+        self.assertSameScores(full, loaded)
+
+    def test_ngram_update(self):
+        for vocabulary, n, storage in NGRAM_CONFIGS:
+            with self.subTest(vocabulary=vocabulary, n=n, storage=storage):
+                self.check_update(lambda input_file: NgramTrainingDataParser(input_file, n, vocabulary, 0.5, storage),
+                                  NgramTrainingDataParser.load)
+
+    def test_tfidf_update(self):
+        self.check_update(lambda input_file: TFIDFWithStopWordTrainingParser(input_file, 'fast'),
+                          TFIDFWithStopWordTrainingParser.load)
+
+    def test_ngram_merge(self):
+        for vocabulary, n, storage in NGRAM_CONFIGS:
+            with self.subTest(vocabulary=vocabulary, n=n, storage=storage):
+                full = self.trained(NgramTrainingDataParser(self.training_file, n, vocabulary, 0.5, storage))
+                merged = self.trained(NgramTrainingDataParser(self.training_file, n, vocabulary, 0.5, storage), 2)
+                self.assertSameScores(full, merged)
+
+
+if __name__ == '__main__':
+    unittest.main()
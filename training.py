@@ -1,23 +1,31 @@
-from language import LANGUAGES
-from ngrams import NgramModel, CharNotInVocabularyException
-from nltk.tokenize import word_tokenize
-from typing import List
+from language import LANGUAGES, is_alpha_count
+from ngrams import NgramModel, insert_text_orders
+from nlp_tools.tokenizers import TOKENIZERS
+from typing import Iterator, List, Set
 
-import copy
 import math
+import numpy as np
 
-count = 0
-# unicode = 17 planes of 2**16 symbols
-for codepoint in range(17 * 2 ** 16):
-    ch = chr(codepoint)
-    if ch.isalpha():
-        count = count + 1
-
-IS_ALPHA_COUNT = count
 BLACKLIST = ['http', 'https']
 BLACKLIST_SET = set(BLACKLIST)
 
 
+def __getattr__(name):
+    """
+    Keeps IS_ALPHA_COUNT importable without computing it at import time
+    """
+    if name == 'IS_ALPHA_COUNT':
+        return is_alpha_count()
+    raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
+
+
+def normalized_tokens(tweet: str, tokenizer: str = 'nltk') -> List[str]:
+    """
+    Tokenizes a tweet into lowercased words, with one of nlp_tools.tokenizers.TOKENIZERS
+    """
+    return [text_token.lower() for text_token in TOKENIZERS[tokenizer](tweet)]
+
+
 class NgramTrainingModel:
     """
     Operates on n-grams models, such as frequency to probability calculator
@@ -36,12 +44,23 @@ class NgramTrainingModel:
         self.score = 0.0
         self.non_existing_char_prob = 0.0
 
-    def _ngrams_list(self, tweet: str):
+    def state(self):
         """
-        Divides the tweet into all the possible contiguous sequences of characters of
-         length [unigram:1, bigram:2, trigram:3]
+        Scalar attributes stored in a model file header
         """
-        return list(tweet[j:j + self.ngram_model.n] for j in range(0, len(tweet) - (self.ngram_model.n - 1)))
+        return {
+            'smoothing': self.smoothing,
+            'docs_for_this_model': self.docs_for_this_model,
+            'class_size': self.class_size,
+            'total_doc_count': self.total_doc_count,
+            'size_of_vocab': self.size_of_vocab,
+            'prior': self.prior,
+            'non_existing_char_prob': self.non_existing_char_prob
+        }
+
+    def load_state(self, state: dict):
+        for attribute, value in state.items():
+            setattr(self, attribute, value)
 
     def _compute_prob_value(self, occurence: int):
         """
@@ -56,7 +75,26 @@ class NgramTrainingModel:
         Given a tweet, tries to insert all possible ngrams, while updating class size
         """
         self.docs_for_this_model += 1
-        self.class_size += self.ngram_model.insert(self._ngrams_list(tweet))
+        self.class_size += self.ngram_model.insert_text(tweet)
+
+    @staticmethod
+    def insert_orders(models: List['NgramTrainingModel'], tweet: str):
+        """
+        insert() of a tweet into the models of one language for n = 1 to len(models), in a single pass
+        over the tweet, see ngrams.insert_text_orders()
+        """
+        counts = insert_text_orders([model.ngram_model for model in models], tweet)
+        for model, count in zip(models, counts):
+            model.docs_for_this_model += 1
+            model.class_size += count
+
+    def merge(self, other: 'NgramTrainingModel'):
+        """
+        Adds the documents and n-grams inserted in other, a model of the same language trained on other data
+        """
+        self.docs_for_this_model += other.docs_for_this_model
+        self.class_size += other.class_size
+        self.ngram_model.merge(other.ngram_model)
 
     def post_parse(self, total_doc_count, smoothing):
         """
@@ -66,44 +104,33 @@ class NgramTrainingModel:
         self.total_doc_count = total_doc_count
         self.size_of_vocab = len(self.ngram_model.corpus)
         if self.ngram_model.vocab == 2:
-            self.size_of_vocab += IS_ALPHA_COUNT
+            self.size_of_vocab += is_alpha_count()
             self.non_existing_char_prob = self._compute_prob_value(0)
-        self.probabilities = copy.deepcopy(self.ngram_model.corpus)
         self.prior = math.log10(self.docs_for_this_model / self.total_doc_count)
 
     def compute(self):
         """
-        Computes probabilities over the held copy of the corpus of the language model
+        Computes probabilities from the occurences held in the corpus of the language model
         """
-        for char_1 in self.probabilities:
-            if isinstance(self.probabilities[char_1], int):
-                self.probabilities[char_1] = self._compute_prob_value(self.probabilities[char_1])
-                continue
-
-            for char_2 in self.probabilities[char_1]:
-                if isinstance(self.probabilities[char_1][char_2], int):
-                    self.probabilities[char_1][char_2] = \
-                        self._compute_prob_value(self.probabilities[char_1][char_2])
-                    continue
-
-                for char_3 in self.probabilities[char_1][char_2]:
-                    if isinstance(self.probabilities[char_1][char_2][char_3], int):
-                        self.probabilities[char_1][char_2][char_3] = \
-                            self._compute_prob_value(self.probabilities[char_1][char_2][char_3])
+        self.probabilities = self.ngram_model.compute_probabilities(self._compute_prob_value)
 
     def test(self, tweet: str):
         """
         Computes score for given tweet for the current class (language)
         """
-        score = self.prior
-        for ngram in self._ngrams_list(tweet):
-            try:
-                self.ngram_model.vocab_safe_check(ngram, False)
-                score += self.ngram_model.get_prob(ngram, self.probabilities)
-            except CharNotInVocabularyException as e:
-                score += self.non_existing_char_prob
-
-        return score
+        n = self.ngram_model.n
+        radix, table = self.ngram_model.code_lookup(self.probabilities)
+        # code of every n-gram of the tweet, -1 for the ones overlapping characters outside of the vocabulary
+        codes = []
+        next_ngram = 0
+        for start, run in self.ngram_model.valid_runs(tweet, False):
+            if len(run) < n:
+                continue
+            codes.extend([-1] * (start - next_ngram))
+            codes.extend(self.ngram_model.iter_codes(run, radix))
+            next_ngram = start + len(run) - n + 1
+        codes.extend([-1] * (len(tweet) - n + 1 - next_ngram))
+        return self.ngram_model.add_code_probs(self.prior, codes, table, self.non_existing_char_prob)
 
 
 class TFIDFWithStopWordTrainingModel:
@@ -111,12 +138,14 @@ class TFIDFWithStopWordTrainingModel:
     Simple bag of words model with increased weight given to stop words not that anymore
     """
 
-    def __init__(self, language: str, stop_words: List[str]):
+    def __init__(self, language: str, stop_words: List[str], tokenizer: str = 'nltk'):
         self.language = language
         self.corpus = {}
         self.stop_words = stop_words
+        self.tokenizer = tokenizer
         self.word_occ_in_other_models = {}
         self.weights = {}
+        self.stale_words = None  # words inserted since the weights were computed, tracked once they are
 
     def insert(self, single_word: str):
         """
@@ -145,11 +174,21 @@ class TFIDFWithStopWordTrainingModel:
                     self.corpus[lower_single_word] += stop_word_value
                 else:
                     self.corpus[lower_single_word] = stop_word_value
+            if self.stale_words is not None:
+                self.stale_words.add(lower_single_word)
+
+    def merge(self, other: 'TFIDFWithStopWordTrainingModel'):
+        """
+        Adds the word occurence values of other, a model of the same language trained on other data
+        """
+        for word, occurence in other.corpus.items():
+            self.corpus[word] = self.corpus.get(word, 0) + occurence
 
     def set_word_occ_in_other_models(self, word_occ):
         """
         Sets the value for the dict of word occurence in other models for the current
-        language. Max value of len(LANGUAGES)
+        language. Max value of len(LANGUAGES). The dict may be shared by every language and
+        hold words missing from this corpus
         """
         self.word_occ_in_other_models = word_occ
 
@@ -160,15 +199,30 @@ class TFIDFWithStopWordTrainingModel:
         for word in self.corpus:
             self.weights[word] = (1 + math.log10(self.corpus[word])) * \
                                  math.log10(len(LANGUAGES) / self.word_occ_in_other_models[word])
+        self.stale_words = set()
+
+    def compute_words(self, words: Set[str]):
+        """
+        Computes tf-idf again for the given words of the corpus only, after an update
+        """
+        for word in words:
+            if word in self.corpus:
+                self.weights[word] = (1 + math.log10(self.corpus[word])) * \
+                                     math.log10(len(LANGUAGES) / self.word_occ_in_other_models[word])
+        self.stale_words = set()
 
     def test(self, tweet: str):
         """
         Computes score for given tweet for the tf-idf stop word training model
         """
+        return self.test_tokens(normalized_tokens(tweet, self.tokenizer))
+
+    def test_tokens(self, lower_text_tokens: List[str]):
+        """
+        Computes score for the lowercased tokens of a tweet
+        """
         score = 0
-        text_tokens = word_tokenize(tweet)
-        for text_token in text_tokens:
-            lower_text_token = text_token.lower()
+        for lower_text_token in lower_text_tokens:
             if lower_text_token in self.weights:
                 score += self.weights[lower_text_token]
         return score
@@ -195,6 +249,79 @@ class Score:
         )
 
 
+class Results:
+    """
+    Compact store of the classified tweets: one record per tweet with the indices of its best scoring
+    and actual languages in self.languages, and its best score. self.languages starts with LANGUAGES,
+    actual languages outside of it are appended as they are met
+    """
+
+    DTYPE = np.dtype([('guessed', np.int16), ('actual', np.int16), ('score', np.float64)])
+
+    def __init__(self):
+        self.tweet_ids: List[str] = []
+        self.languages: List[str] = list(LANGUAGES)
+        self._language_index = {language: index for index, language in enumerate(LANGUAGES)}
+        self._chunks: List[np.ndarray] = []
+        self._records = np.zeros(0, dtype=self.DTYPE)
+
+    def __len__(self):
+        return len(self.tweet_ids)
+
+    def _index(self, language: str) -> int:
+        if language not in self._language_index:
+            self._language_index[language] = len(self.languages)
+            self.languages.append(language)
+        return self._language_index[language]
+
+    def add_batch(self, tweet_ids: List[str], actual_languages: List[str], lang_scores: np.ndarray) -> np.ndarray:
+        """
+        Keeps the best of the scores of shape [len(tweet_ids), len(LANGUAGES)], the first one on a tie.
+        Returns the records of the batch
+        """
+        guessed = lang_scores.argmax(axis=1)
+        chunk = np.empty(len(tweet_ids), dtype=self.DTYPE)
+        chunk['guessed'] = guessed
+        chunk['actual'] = [self._index(language) for language in actual_languages]
+        chunk['score'] = lang_scores[np.arange(len(tweet_ids)), guessed]
+        self.tweet_ids.extend(tweet_ids)
+        self._chunks.append(chunk)
+        return chunk
+
+    @property
+    def records(self) -> np.ndarray:
+        """
+        Structured array of every result, in input order
+        """
+        if self._chunks:
+            self._records = np.concatenate([self._records] + self._chunks)
+            self._chunks = []
+        return self._records
+
+    def __iter__(self) -> Iterator[Score]:
+        return self.scores(self.tweet_ids, self.records)
+
+    def scores(self, tweet_ids: List[str], records: np.ndarray) -> Iterator[Score]:
+        """
+        Score of every record, records being the ones of tweet_ids
+        """
+        # a score of -0.0 is a sum of no weight, written 0 like the original models did
+        empty_sums = (np.signbit(records['score']) & (records['score'] == 0)).tolist()
+        for tweet_id, guessed, actual, score, empty_sum in zip(tweet_ids, records['guessed'].tolist(),
+                                                               records['actual'].tolist(),
+                                                               records['score'].tolist(), empty_sums):
+            yield Score(tweet_id, 0 if empty_sum else score, self.languages[guessed], self.languages[actual])
+
+    def confusion_matrix(self) -> np.ndarray:
+        """
+        Number of tweets per [guessed, actual] pair of indices in self.languages
+        """
+        records = self.records
+        size = len(self.languages)
+        return np.bincount(records['guessed'].astype(np.int64) * size + records['actual'],
+                           minlength=size * size).reshape(size, size)
+
+
 class ClassScore:
     """
     For a given class (i.e: language), holds stats regarding the parsed data
@@ -0,0 +1,124 @@
+from abc import ABC, abstractmethod
+from training import Score
+
+import csv
+import gzip
+import json
+
+GZIP_EXTENSION = '.gz'
+OUTPUT_BUFFER_SIZE = 1 << 16
+BYTE_ORDER_MARK = '\ufeff'
+
+
+def open_output(path: str):
+    """
+    Opens a buffered text file for writing, gzip compressed when path ends with .gz
+    """
+    if path.endswith(GZIP_EXTENSION):
+        return gzip.open(path, 'wt')
+    return open(path, 'w', buffering=OUTPUT_BUFFER_SIZE)
+
+
+class TraceWriter(ABC):
+    """
+    Writes the best score of every test tweet as soon as it is classified
+    """
+
+    EXTENSION = '.txt'
+
+    def __init__(self, path: str):
+        self.stream = open_output(path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    @abstractmethod
+    def write(self, score: Score):
+        pass
+
+    @staticmethod
+    def tweet_id(score: Score) -> str:
+        """
+        Tweet id of a score without the byte order mark starting the first line of some test files, for the
+        machine-readable formats to give the ids as they are
+        """
+        if score.tweet_id.startswith(BYTE_ORDER_MARK):
+            return score.tweet_id[len(BYTE_ORDER_MARK):]
+        return score.tweet_id
+
+    def write_accuracy(self, accuracy: float):
+        """
+        Ends the trace once every tweet is written, machine-readable formats leave accuracy to the eval file
+        """
+        pass
+
+    def close(self):
+        self.stream.close()
+
+
+class TextTraceWriter(TraceWriter):
+    """
+    Tab separated lines, followed by the accuracy
+    """
+
+    def write(self, score: Score):
+        self.stream.write(str(score))
+
+    def write_accuracy(self, accuracy: float):
+        self.stream.write('\n\nAccuracy: {}'.format(accuracy))
+
+
+class JsonlTraceWriter(TraceWriter):
+    """
+    One JSON object per line
+    """
+
+    EXTENSION = '.jsonl'
+
+    def write(self, score: Score):
+        self.stream.write(json.dumps({
+            'tweet_id': self.tweet_id(score),
+            'guessed_lang': score.guessed_lang,
+            'score': score.score,
+            'actual_lang': score.actual_lang,
+            'correct': score.is_correct
+        }) + '\n')
+
+
+class CsvTraceWriter(TraceWriter):
+    """
+    Comma separated values with a header line
+    """
+
+    EXTENSION = '.csv'
+    HEADER = ['tweet_id', 'guessed_lang', 'score', 'actual_lang', 'correct']
+
+    def __init__(self, path: str):
+        super(CsvTraceWriter, self).__init__(path)
+        self.writer = csv.writer(self.stream, lineterminator='\n')
+        self.writer.writerow(self.HEADER)
+
+    def write(self, score: Score):
+        self.writer.writerow([self.tweet_id(score), score.guessed_lang, score.score, score.actual_lang,
+                              'correct' if score.is_correct else 'wrong'])
+
+
+TRACE_WRITERS = {
+    'text': TextTraceWriter,
+    'jsonl': JsonlTraceWriter,
+    'csv': CsvTraceWriter
+}
+
+
+def trace_path(path: str, trace_format: str, compress: bool) -> str:
+    """
+    Path of a trace file in the given format: the extension of path is replaced by the one of the format,
+    .gz is appended when compressed
+    """
+    extension = TRACE_WRITERS[trace_format].EXTENSION
+    if path.endswith(TraceWriter.EXTENSION):
+        path = path[:-len(TraceWriter.EXTENSION)]
+    return path + extension + (GZIP_EXTENSION if compress else '')